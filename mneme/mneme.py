@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 
-import sys
+import os, sys
 from os import path
 from mneme_common import CONFIG, VERSION
 
+# Commands `mneme daemon` can answer for us.
+DAEMON_COMMANDS = ("latest", "l", "playing", "np", "search", "s", "stats")
+
 
 def show_help(script_name):
     print(
@@ -11,26 +14,63 @@ def show_help(script_name):
 
 Commands:
 
+  add            Records files, or whole directory trees, without playing
+                 them. Only new or changed files get hashed, --batch=N sets
+                 how many files are committed at a time.
+  analytics      Reports play time per day, week or month (by passing days,
+                 weeks or months), the most played files (top) or the most
+                 renamed ones (renames), optionally followed by how many.
+                 Pass --rebuild to recompute the underlying rollups, say
+                 after changing time zones.
+  bench          Runs the named benchmark, or all of them, printing results
+                 as JSON lines.
+  calc-grips     Recomputes the grips of finished media events, in chunks of
+                 --chunk=N events committed one at a time. When interrupted,
+                 picks up where it left off, unless passed --restart.
+                 --workers=N computes grips in N processes. Reports grips
+                 that end up shared by several events.
   cleanup        Scan events and cleanup files and filepaths unreferenced by
-                 records in history.
+                 records in history. Pass --dry-run to only count them, or
+                 --chunk=N to delete in batches of N, releasing the lock in
+                 between.
+  daemon         Serves the playing, latest, search and stats commands over
+                 the Unix socket set as daemon_socket in the config, from a
+                 warm connection. While it runs, these commands go through
+                 the daemon, unless run with a different TZ than it has.
   delete, del    Delete media events from history by passing their grip or
-                 grip-spec as arguments.
+                 grip-spec as arguments, pass - to read them from stdin or
+                 --from=FILE to read them from a file.
   fsearch, fs    Searches for media files and their last known location, the
-                 arguments being the search query.
+                 arguments being the search query. Pass --like to match
+                 substrings exactly.
   hash, h        Computes sampling hash for files passed as arguments.
   latest, l      Lists latest media events entries in history; defaults to
-                 last {1}, but one can pass any limit as argument.
+                 last {1}, but one can pass any limit as argument. Page
+                 through with --limit, --offset and --before.
   hashes, lh     Lists all recorded hashes and filenames.
+  migrate        Converts how timestamps are stored, pass --timestamps=int
+                 for integer microseconds since the epoch (smaller, faster
+                 to compare) or --timestamps=text for ISO 8601 text, the
+                 default.
   playing, np    Prints currently active media event, if any.
   purge          Purges history records of files that match the hashes passed
-                 as arguments.
+                 as arguments, or read from stdin (-) or --from=FILE.
   search, s      Searches through history for the media events, the arguments
-                 being the search query.
+                 being the search query. Pass --like to match substrings
+                 exactly, page through with --limit, --offset and --after.
   stats          Gives some simple stats about files, filepaths and the history.
   version        Prints version information.
   wrapper, w     Records the event into history and passes the arguments along
                  to the configured media player.
 
+OUTPUT FORMATS:
+The analytics, fsearch, latest, hashes, search and stats commands take
+--format with one of jsonl, tsv or nul, for machine-readable output.
+Datetimes are then printed in UTC (ISO 8601), unless --localtime is passed
+as well. With nul, every field is followed by a NUL and nothing is escaped.
+The column names come first, ended by an extra NUL (an empty field), then
+each row is as many fields as there are columns.
+
 GRIP-SPEC:
 Functions as an identifier for a media event, it's format is:
 [YYYY.[MM.[DD.]]]<GRIP>. The year, month and day parts are each
@@ -39,21 +79,40 @@ optional, unless there are multiple events with the same grip."""
         file=sys.stderr
     )
 
-def run_mneme():
-    script = path.basename(sys.argv[0])
+def run_command(script):
     if len(sys.argv) > 1:
         command = sys.argv[1]
         sys.argv = sys.argv[1:]
+        if command in DAEMON_COMMANDS and CONFIG.daemon_socket:
+            from mneme_client import call_daemon
+            if call_daemon(sys.argv):
+                return
         match command:
 
             case "add":
                 from mneme_misc import run_add
                 run_add()
 
+            case "analytics":
+                from mneme_analytics import run_analytics
+                run_analytics()
+
+            case "bench":
+                from mneme_bench import run_bench
+                run_bench()
+
+            case "calc-grips":
+                from mneme_misc import run_calc_grips
+                run_calc_grips()
+
             case "cleanup":
                 from mneme_modify import run_cleanup
                 run_cleanup()
 
+            case "daemon":
+                from mneme_daemon import run_daemon
+                run_daemon()
+
             case "delete" | "del":
                 from mneme_modify import run_delete
                 run_delete()
@@ -63,12 +122,8 @@ def run_mneme():
                 run_filesearch()
 
             case "hash" | "h":
-                from mneme_digests import sampling_hash
-                from mneme_funcs import replace_ws
-                files = sys.argv[1:]
-                for f in files:
-                    if path.isfile(f):
-                        print("{}  {}".format(sampling_hash(f), replace_ws(f)))
+                from mneme_misc import run_hash
+                run_hash()
 
             case "latest" | "l":
                 from mneme_query import run_latest
@@ -78,6 +133,10 @@ def run_mneme():
                 from mneme_query import run_list_hashes
                 run_list_hashes()
 
+            case "migrate":
+                from mneme_modify import run_migrate
+                run_migrate()
+
             case "playing" | "np":
                 from mneme_query import run_playing
                 run_playing()
@@ -106,5 +165,17 @@ def run_mneme():
     else:
         show_help(script)
 
+def run_mneme():
+    script = path.basename(sys.argv[0])
+    try:
+        run_command(script)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Our output got cut short (think `mneme search | head`), point stdout
+        # at devnull so Python doesn't complain again when flushing on exit.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+
 if __name__ == "__main__":
     run_mneme()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import sys
+from datetime import timedelta
+
+from mneme_common import (
+    CONFIG, initialize_sqlite, retry_busy, write_transaction
+)
+from mneme_funcs import (
+    chunked_writer, column_names, get_format, get_int, parse_opts, print_rows,
+    replace_ws
+)
+from mneme_query import FORMAT_OPTIONS
+from mneme_sql import (
+    CLEAR_FILE_PLAYS, CLEAR_PLAY_DAYS, FILL_FILE_PLAYS, FILL_PLAY_DAYS,
+    PLAY_PERIODS, RECOUNT_RENAMES, RENAMED_FILES, TOP_FILES, period_plays,
+    plays_sql, renamed_file, top_file, typed
+)
+
+# Reports besides play time per period, see `PLAY_PERIODS`.
+REPORTS = ("top", "renames")
+
+
+def refill_rollups(cur):
+    for stmt in (CLEAR_PLAY_DAYS, FILL_PLAY_DAYS, CLEAR_FILE_PLAYS,
+                 FILL_FILE_PLAYS, RECOUNT_RENAMES):
+        cur.execute(stmt)
+
+def rebuild_rollups(conn):
+    # Recomputes the rollups from history, for when they drifted (or the time
+    # zone changed, days are bucketed in local time).
+    write_transaction(conn, refill_rollups)
+
+def period_start(period, count):
+    # Modifier taking us from the current period to the first of count
+    # periods.
+    match period:
+        case "days":
+            return "-{} days".format(count - 1)
+        case "weeks":
+            return "-{} days".format(7 * (count - 1))
+        case "months":
+            return "-{} months".format(count - 1)
+
+def fmt_play_time(play_secs):
+    return str(timedelta(seconds=play_secs))
+
+def print_plays(results):
+    out = chunked_writer()
+    for row in results:
+        out.write("{:<10}  {:>5} plays  {:>14}\n".format(
+            row.period, row.events, fmt_play_time(row.play_secs)
+        ))
+    out.flush()
+
+def print_top(results):
+    out = chunked_writer()
+    for row in results:
+        out.write("{:>14}  {:>5} plays  {}\n".format(
+            fmt_play_time(row.play_secs), row.events, replace_ws(row.name)
+        ))
+    out.flush()
+
+def print_renamed(results):
+    out = chunked_writer()
+    for row in results:
+        out.write("{:>5} renames  {}\n".format(
+            row.renames, replace_ws(row.name)
+        ))
+    out.flush()
+
+
+##### ENTRYPOINTS #####
+
+# mneme <analytics> [--rebuild] [--format=FMT]
+#                   [days|weeks|months|top|renames] [count]
+def run_analytics():
+    opts, args = parse_opts(
+        sys.argv[1:], flags=("--rebuild",), options=FORMAT_OPTIONS
+    )
+    fmt = get_format(opts)
+    report = args[0] if args else "days"
+    if not (report in PLAY_PERIODS or report in REPORTS):
+        sys.exit("Unknown report '{}', choose from: {}.".format(
+            report, ", ".join(tuple(PLAY_PERIODS) + REPORTS)
+        ))
+    count = max(get_int(args[1] if len(args) > 1 else None,
+                        CONFIG.latest_default_limit), 1)
+
+    if "--rebuild" in opts:
+        conn = initialize_sqlite()
+        retry_busy(rebuild_rollups, conn)
+        print("Rebuilt listening analytics from history.", file=sys.stderr)
+    else:
+        conn = initialize_sqlite(readonly=True)
+
+    if report in PLAY_PERIODS:
+        cur = typed(conn.cursor(), period_plays).execute(
+            plays_sql(report), (period_start(report, count),)
+        )
+        printer = print_plays
+    elif report == "top":
+        cur = typed(conn.cursor(), top_file).execute(TOP_FILES, (count,))
+        printer = print_top
+    else:
+        cur = typed(conn.cursor(), renamed_file).execute(
+            RENAMED_FILES, (count,)
+        )
+        printer = print_renamed
+    if fmt:
+        print_rows(column_names(cur), cur, fmt)
+    else:
+        printer(cur)
@@ -0,0 +1,599 @@
+#!/usr/bin/env python
+
+# Commands timed by `bench startup`, none of which change anything.
+STARTUP_COMMANDS = (
+    ["version"], ["hash"], ["playing"], ["latest", "1"], ["stats"]
+)
+# Cold starts slower than this many milliseconds fail `bench startup`.
+STARTUP_THRESHOLD_MS = 150
+# Config for benchmarks running mneme against a scratch DB, see `bench_home`.
+BENCH_CONFIG = """db_file = {db_file}
+media_player = {media_player}
+digest_cache = ""
+daemon_socket = ""
+log_timings = true
+
+[sqlite]
+journal_mode = {journal_mode}
+"""
+
+import json, os, random, re, sqlite3, subprocess, sys, tempfile, time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from mneme_analytics import rebuild_rollups
+from mneme_common import VERSION, migrate
+from mneme_digests import (
+    CK_SAMPLE_SIZE, SKIP_VALUES, _sample_preadv, _sample_seek,
+    sample_locations
+)
+from mneme_funcs import replace_ws
+from mneme_misc import calc_grips, event_grip
+from mneme_modify import parse_del_args, resolve_grip_specs
+from mnemedt import mnemedt
+import mneme_sql as sql
+
+# Fixtures and the legacy implementations we time against live with the tests.
+sys.path.append(path.join(
+    path.dirname(path.dirname(path.abspath(__file__))), "tests"
+))
+from mneme_fixtures import (
+    grips_db, hash_all, legacy_replace_ws, legacy_sample_locations,
+    placeholder_grip, scratch_db, sparse_files, synthetic_db, synthetic_paths
+)
+
+
+##### HELPER FUNCTIONS #####
+
+def get_int(args, idx, default):
+    try:
+        return int(args[idx])
+    except (IndexError, ValueError):
+        return default
+
+def report(name, results):
+    print(json.dumps({"benchmark": name} | results))
+
+def best_of(fn, repeat=5):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+def bench_home(directory, journal_mode="wal", play_secs=0.05):
+    # Sets up a home directory with a config pointing at a scratch DB, and a
+    # stub media player sleeping for play_secs. Returns the environment to
+    # run mneme with.
+    os.makedirs(path.join(directory, ".config"))
+    player = path.join(directory, "player")
+    with open(player, "w") as f:
+        f.write("#!/bin/sh\nsleep {}\n".format(play_secs))
+    os.chmod(player, 0o755)
+    with open(path.join(directory, ".config", "mneme.toml"), "w") as f:
+        f.write(BENCH_CONFIG.format(
+            db_file=json.dumps(path.join(directory, "mneme.sqlite")),
+            media_player=json.dumps(player),
+            journal_mode=json.dumps(journal_mode),
+        ))
+    return dict(os.environ, HOME=directory)
+
+
+##### BENCHMARKS #####
+
+# mneme bench escape [count]
+def bench_escape(args):
+    paths = synthetic_paths(get_int(args, 0, 100000))
+    legacy = best_of(lambda: list(map(legacy_replace_ws, paths)))
+    current = best_of(lambda: list(map(replace_ws, paths)))
+    report("escape", {
+        "paths": len(paths),
+        "legacy_secs": legacy,
+        "translate_secs": current,
+        "speedup": legacy / current,
+    })
+
+# mneme bench digests [count]
+def bench_digests(args):
+    count = get_int(args, 0, 200)
+    # Edge cases around the sample size, then a spread up to ~64 GiB.
+    sizes = [0, 1, CK_SAMPLE_SIZE - 1, CK_SAMPLE_SIZE, CK_SAMPLE_SIZE + 1,
+             2 * CK_SAMPLE_SIZE, 32 * CK_SAMPLE_SIZE + 3]
+    # Sizes where the midpoint or end sample overlaps a skip, which the
+    # preadv reader coalesces into a single read.
+    sizes += [2 * SKIP_VALUES[0] + 100, SKIP_VALUES[0] + CK_SAMPLE_SIZE + 5,
+              2 * SKIP_VALUES[0] * SKIP_VALUES[1] + CK_SAMPLE_SIZE]
+    rnd = random.Random(0)
+    sizes += [rnd.randrange(1 << 20, 1 << 36) for i in range(count)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filepaths = sparse_files(tmp, sizes)
+        legacy = best_of(lambda: hash_all(filepaths, _sample_seek))
+        current = best_of(lambda: hash_all(filepaths, _sample_preadv))
+    report("digests", {
+        "files": len(filepaths),
+        "seek_secs": legacy,
+        "preadv_secs": current,
+        "speedup": legacy / current,
+    })
+
+# mneme bench locations [count]
+def bench_locations(args):
+    count = get_int(args, 0, 100000)
+    rnd = random.Random(0)
+    # A batch of episodes, only a few different sizes between them.
+    sizes = [rnd.randrange(1 << 48) for i in range(16)]
+    batch = [rnd.choice(sizes) for i in range(count)]
+    legacy = best_of(lambda: list(map(legacy_sample_locations, batch)))
+    current = best_of(lambda: list(map(sample_locations, batch)))
+    report("locations", {
+        "batch": len(batch),
+        "legacy_secs": legacy,
+        "memoized_secs": current,
+        "speedup": legacy / current,
+    })
+
+def mneme_cmd(argv, *options):
+    script = path.join(path.dirname(path.abspath(__file__)), "mneme.py")
+    return [sys.executable] + list(options) + [script] + argv
+
+def import_times(argv):
+    # Cumulative import time of each top level module, in microseconds.
+    result = subprocess.run(
+        mneme_cmd(argv, "-X", "importtime"), capture_output=True, text=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            if not fields[2].startswith("  "):
+                times[fields[2].strip()] = int(fields[1])
+    return times
+
+# mneme bench startup [runs [threshold_ms]]
+def bench_startup(args):
+    runs = get_int(args, 0, 10)
+    threshold = get_int(args, 1, STARTUP_THRESHOLD_MS)
+    slow = []
+    for argv in STARTUP_COMMANDS:
+        cmd = mneme_cmd(argv)
+        wall = best_of(
+            lambda: subprocess.run(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            ),
+            runs
+        )
+        imports = import_times(argv)
+        heaviest = sorted(imports, key=imports.get, reverse=True)[:5]
+        report("startup", {
+            "command": " ".join(argv),
+            "wall_ms": wall * 1000,
+            "imports_ms": sum(imports.values()) / 1000,
+            "heaviest_imports": {name: imports[name] / 1000
+                                 for name in heaviest},
+        })
+        if wall * 1000 > threshold:
+            slow.append(" ".join(argv))
+    if slow:
+        sys.exit("Cold start took over {} ms for: {}."
+                 .format(threshold, ", ".join(slow)))
+
+def timed_run(cmd, env):
+    t0 = time.perf_counter()
+    result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    return (time.perf_counter() - t0, result)
+
+def lock_waits(results):
+    # Time spent waiting on the lock, as reported by wrappers logging timings.
+    waits = []
+    for elapsed, result in results:
+        match = re.search(r"([\d.]+) ms waiting on lock", result.stderr)
+        if match:
+            waits.append(float(match[1]))
+    return waits
+
+def concurrency_round(env, media, writers, readers):
+    # Starts all wrappers and readers at once, each a process of their own.
+    jobs = [mneme_cmd(["wrapper", media[i % len(media)]])
+            for i in range(writers)]
+    jobs += [mneme_cmd(["latest", "5"]) for i in range(readers)]
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        results = list(pool.map(lambda cmd: timed_run(cmd, env), jobs))
+    return (results[:writers], results[writers:])
+
+# mneme bench concurrency [writers [readers [rounds]]]
+def bench_concurrency(args):
+    writers = get_int(args, 0, 8)
+    readers = get_int(args, 1, 8)
+    rounds = get_int(args, 2, 5)
+    for journal_mode in ("delete", "wal"):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = bench_home(tmp, journal_mode)
+            media = sparse_files(tmp, [(i + 1) << 20 for i in range(writers)])
+            subprocess.run(mneme_cmd(["stats"]), env=env, capture_output=True)
+
+            t0 = time.perf_counter()
+            wrote, read = [], []
+            for i in range(rounds):
+                w, r = concurrency_round(env, media, writers, readers)
+                wrote += w
+                read += r
+            wall = time.perf_counter() - t0
+
+        waits = lock_waits(wrote)
+        failed = [result for elapsed, result in wrote + read
+                  if result.returncode or "unable" in result.stderr]
+        report("concurrency", {
+            "journal_mode": journal_mode,
+            "writers": writers,
+            "readers": readers,
+            "rounds": rounds,
+            "wall_secs": wall,
+            "lock_wait_ms_mean": sum(waits) / len(waits) if waits else None,
+            "lock_wait_ms_max": max(waits, default=None),
+            "reader_ms_mean": sum(e for e, r in read) / len(read) * 1000
+                              if read else None,
+            "reader_ms_max": max((e for e, r in read), default=0) * 1000,
+            "failures": len(failed),
+        })
+
+# mneme bench plans
+def bench_plans(args):
+    # How much the statement cache saves us, preparing the latest query anew
+    # each time versus reusing it.
+    stmt, params = sql.events_sql([], True), (1, 0)
+    conn = scratch_db()
+    cold = sqlite3.connect(":memory:", cached_statements=0)
+    migrate(cold)
+    report("plans", {
+        "statement_cache_size": sql.STATEMENT_CACHE_SIZE,
+        "uncached_secs": best_of(
+            lambda: [cold.execute(stmt, params).fetchall()
+                     for i in range(10000)]
+        ),
+        "cached_secs": best_of(
+            lambda: [conn.execute(stmt, params).fetchall()
+                     for i in range(10000)]
+        ),
+    })
+
+def index_bytes(directory, name, values, col_type):
+    # Size of an index over the values, as stored in a column of col_type.
+    conn = sqlite3.connect(path.join(directory, name + ".sqlite"))
+    conn.execute("CREATE TABLE t(id INTEGER PRIMARY KEY, dt {})"
+                 .format(col_type))
+    conn.executemany("INSERT INTO t(dt) VALUES(?)", ((v,) for v in values))
+    conn.commit()
+    before = conn.execute("PRAGMA page_count").fetchone()[0]
+    conn.execute("CREATE INDEX t_idx ON t(dt)")
+    conn.commit()
+    after = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return (conn, (after - before) * page_size)
+
+# mneme bench timestamps [count]
+def bench_timestamps(args):
+    count = get_int(args, 0, 200000)
+    rnd = random.Random(0)
+    # Roughly ten years of media events.
+    start = int(mnemedt.fromstr("2016-01-01T00:00:00Z"))
+    ints = sorted(rnd.randrange(start, start + 10 * 365 * 86400 * 10**6)
+                  for i in range(count))
+    texts = [str(mnemedt.fromint(i)) for i in ints]
+
+    month = [mnemedt.fromstr(dt) for dt in ("2020-03-01T00:00:00Z",
+                                           "2020-04-01T00:00:00Z")]
+    with tempfile.TemporaryDirectory() as tmp:
+        text_conn, text_bytes = index_bytes(tmp, "text", texts, "TEXT")
+        int_conn, int_bytes = index_bytes(tmp, "int", ints, "INTEGER")
+        scan = "SELECT count(*) FROM t WHERE dt >= ? AND dt < ?"
+        text_params = [str(dt) for dt in month]
+        int_params = [int(dt) for dt in month]
+
+        report("timestamps", {
+            "rows": count,
+            "parse_text_secs": best_of(lambda: list(
+                map(mnemedt.fromstr, texts))),
+            "parse_int_secs": best_of(lambda: list(
+                map(mnemedt.fromint, ints))),
+            "format_text_secs": best_of(lambda: [str(mnemedt.fromint(i))
+                                                 for i in ints]),
+            "format_int_secs": best_of(lambda: [int(mnemedt.fromint(i))
+                                                for i in ints]),
+            "index_text_bytes": text_bytes,
+            "index_int_bytes": int_bytes,
+            "month_scan_text_secs": best_of(lambda: [
+                text_conn.execute(scan, text_params).fetchone()
+                for i in range(100)]),
+            "month_scan_int_secs": best_of(lambda: [
+                int_conn.execute(scan, int_params).fetchone()
+                for i in range(100)]),
+        })
+        text_conn.close()
+        int_conn.close()
+
+# Play time per month and top files, aggregated from history itself, as
+# analytics would without its rollups.
+NAIVE_REPORTS = (
+    """SELECT substr({}, 1, 7) AS period, count(id), sum(play_secs)
+FROM history WHERE play_secs NOT NULL
+GROUP BY period ORDER BY period DESC""".format(sql.LOCAL_DAY),
+    """SELECT file_id, count(id), sum(play_secs) AS secs
+FROM history WHERE play_secs NOT NULL
+GROUP BY file_id ORDER BY secs DESC LIMIT 10""",
+)
+
+# mneme bench analytics [events]
+def bench_analytics(args):
+    count = get_int(args, 0, 100000)
+    rnd = random.Random(0)
+    conn = scratch_db()
+    conn.executemany("INSERT INTO files(hash) VALUES(?)",
+                     (("{:032x}".format(i),) for i in range(1000)))
+    conn.execute("INSERT INTO filetrack(file_id, filepath, first_seen_dt, "
+                 "last_seen_dt) SELECT id, hash, '', '' FROM files")
+    now = int(mnemedt.now())
+    def events():
+        for i in range(count):
+            start = mnemedt.fromint(now - rnd.randrange(730 * 86400 * 10**6))
+            play_secs = rnd.randrange(3600) if rnd.random() < 0.98 else None
+            file_id = rnd.randrange(1, 1001)
+            yield (file_id, file_id, str(start), play_secs,
+                   placeholder_grip(i))
+
+    # Everything through the triggers: inserts, stops, then deletes.
+    started = time.perf_counter()
+    conn.executemany("INSERT INTO history(file_id, ftrack_id, start_dt, "
+                     "play_secs, grip) VALUES(?, ?, ?, ?, ?)", events())
+    insert_secs = time.perf_counter() - started
+    conn.execute("UPDATE history SET play_secs = 60 "
+                 "WHERE play_secs IS NULL AND id % 2 = 0")
+    conn.execute("DELETE FROM history WHERE id % 10 = 0")
+    conn.commit()
+    rebuild_secs = best_of(lambda: rebuild_rollups(conn), repeat=1)
+
+    months = sql.plays_sql("months")
+    report("analytics", {
+        "events": count,
+        "insert_secs": insert_secs,
+        "rebuild_secs": rebuild_secs,
+        "months_secs": best_of(
+            lambda: conn.execute(months, ("-23 months",)).fetchall()),
+        "months_naive_secs": best_of(
+            lambda: conn.execute(NAIVE_REPORTS[0]).fetchall()),
+        "top_secs": best_of(
+            lambda: conn.execute(sql.TOP_FILES, (10,)).fetchall()),
+        "top_naive_secs": best_of(
+            lambda: conn.execute(NAIVE_REPORTS[1]).fetchall()),
+    })
+
+def legacy_calc_grips(conn):
+    # What calc-grips used to do, one UPDATE per row in a single transaction.
+    for row in conn.execute(sql.CLOSED_EVENTS, (0, -1)).fetchall():
+        conn.execute(sql.SET_GRIP, (event_grip(row), row[0]))
+    conn.commit()
+
+# mneme bench grips [events]
+def bench_grips(args):
+    from concurrent.futures import ProcessPoolExecutor
+
+    count = get_int(args, 0, 100000)
+    chunk_size = max(count // 20, 1)
+    results = {"events": count}
+
+    conn = grips_db(count)
+    started = time.perf_counter()
+    legacy_calc_grips(conn)
+    results["legacy_secs"] = time.perf_counter() - started
+
+    # Interrupted after two chunks, then resumed from the checkpoint.
+    conn = grips_db(count)
+    started = time.perf_counter()
+    job = calc_grips(conn, chunk_size)
+    next(job), next(job)
+    job.close()
+    for chunk in calc_grips(conn, chunk_size):
+        pass
+    results["chunked_secs"] = time.perf_counter() - started
+
+    conn = grips_db(count)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        started = time.perf_counter()
+        for chunk in calc_grips(conn, chunk_size, pool):
+            pass
+        results["pool_secs"] = time.perf_counter() - started
+        results["pool_workers"] = os.cpu_count()
+    report("grips", results)
+
+def bulk_history(conn, count, rnd):
+    # Fills history with count events of random grips, with the triggers on
+    # history out of the way, and then fills in what they'd have maintained.
+    triggers = conn.execute(
+        "SELECT name, sql FROM sqlite_schema "
+        "WHERE type = 'trigger' AND tbl_name = 'history'"
+    ).fetchall()
+    for name, trigger_sql in triggers:
+        conn.execute("DROP TRIGGER {}".format(name))
+    now = int(mnemedt.now())
+    conn.executemany(
+        "INSERT INTO history(file_id, ftrack_id, start_dt, grip) "
+        "VALUES(1, 1, ?, ?)",
+        ((str(mnemedt.fromint(now - rnd.randrange(3650 * 86400 * 10**6))),
+          "{:08x}".format(rnd.getrandbits(32))) for i in range(count))
+    )
+    conn.execute("INSERT INTO grip_counts "
+                 "SELECT grip, count(id) FROM history GROUP BY grip")
+    conn.execute("UPDATE history SET grip_spec = v.grip_spec "
+                 "FROM v_grip_specs AS v "
+                 "WHERE history.id = v.id AND v.grip_spec NOT NULL")
+    for name, trigger_sql in triggers:
+        conn.execute(trigger_sql)
+    conn.commit()
+
+# mneme bench gripspecs [events] [specs]
+def bench_gripspecs(args):
+    count = get_int(args, 0, 2000000)
+    batch = get_int(args, 1, 1000)
+    rnd = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(path.join(tmp, "history.sqlite"))
+        migrate(conn)
+        conn.execute("INSERT INTO files(hash) VALUES('')")
+        conn.execute("INSERT INTO filetrack(file_id, filepath, "
+                     "first_seen_dt, last_seen_dt) VALUES(1, '', '', '')")
+        started = time.perf_counter()
+        bulk_history(conn, count, rnd)
+        load_secs = time.perf_counter() - started
+
+        # Adding events one at a time, with the triggers keeping grip-specs
+        # (and everything else) up to date.
+        started = time.perf_counter()
+        for i in range(1000):
+            conn.execute(
+                "INSERT INTO history(file_id, ftrack_id, start_dt, grip) "
+                "VALUES(1, 1, ?, ?)",
+                (str(mnemedt.now()), "{:08x}".format(rnd.getrandbits(32)))
+            )
+        conn.commit()
+        insert_secs = (time.perf_counter() - started) / 1000
+
+        # Resolve the events by the grip-specs we'd show for them, some of
+        # them colliding, in one batch.
+        colliding = conn.execute(
+            "SELECT id, grip_spec FROM history WHERE grip_spec NOT NULL "
+            "ORDER BY random() LIMIT ?", (batch // 2,)
+        ).fetchall()
+        unique = conn.execute(
+            "SELECT id, grip FROM history WHERE grip_spec IS NULL "
+            "ORDER BY random() LIMIT ?", (batch - len(colliding),)
+        ).fetchall()
+        specs = parse_del_args(spec for hist_id, spec in colliding + unique)
+        def resolve():
+            return {spec: [match.id for match in matches] for spec, matches
+                    in resolve_grip_specs(conn.cursor(), specs)}
+        ambiguous = [spec for spec, ids in resolve().items() if len(ids) > 1]
+
+        report("gripspecs", {
+            "events": count,
+            "colliding_events": conn.execute(
+                "SELECT count(id) FROM history WHERE grip_spec NOT NULL"
+            ).fetchone()[0],
+            "load_secs": load_secs,
+            "insert_secs": insert_secs,
+            "specs": len(specs),
+            "ambiguous_specs": len(ambiguous),
+            "resolve_secs": best_of(resolve),
+        })
+        conn.close()
+
+def bookkeeping_ms(result):
+    # Time the wrapper spent on the DB and hashing, as it logs it.
+    match = re.search(r"bookkeeping took ([\d.]+) ms", result.stderr)
+    return float(match[1]) if match else None
+
+def time_entrypoint(env, label, argv, runs, failures):
+    # Times a mneme command run as its own process, like a user would.
+    timings = [timed_run(mneme_cmd(argv), env) for i in range(runs)]
+    secs = sorted(elapsed for elapsed, result in timings)
+    failed = [result for elapsed, result in timings if result.returncode]
+    if failed:
+        failures.append(label)
+    results = {
+        "command": label,
+        "runs": runs,
+        "best_ms": secs[0] * 1000,
+        "median_ms": secs[len(secs) // 2] * 1000,
+        "failures": len(failed),
+    }
+    if argv[0] == "wrapper":
+        waits = [bookkeeping_ms(result) for elapsed, result in timings]
+        results["bookkeeping_ms"] = min(filter(None, waits), default=None)
+    return results
+
+# mneme bench entrypoints [files [filepaths [events [runs]]]]
+def bench_entrypoints(args):
+    files = max(get_int(args, 0, 5000), 1)
+    filepaths = max(get_int(args, 1, files * 2), files)
+    events = get_int(args, 2, 100000)
+    runs = max(get_int(args, 3, 5), 1)
+    rnd = random.Random(0)
+    failures = []
+
+    # Labelled by the command with only what stays the same between runs, so
+    # results can be compared across versions.
+    def bench(label, argv, runs=runs):
+        report("entrypoints", {"version": VERSION} |
+               time_entrypoint(env, label, argv, runs, failures))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = bench_home(tmp, play_secs=0)
+        media_dir = path.join(tmp, "media")
+        os.mkdir(media_dir)
+        media = sparse_files(media_dir, [rnd.randrange(1 << 28, 1 << 33)
+                                         for i in range(20)])
+        # The DB, as initialize_sqlite sets it up.
+        subprocess.run(mneme_cmd(["stats"]), env=env, capture_output=True)
+        db_file = path.join(tmp, "mneme.sqlite")
+        started = time.perf_counter()
+        made = synthetic_db(db_file, files, filepaths, events, rnd)
+        report("entrypoints", {"version": VERSION, "command": "generate",
+                               "secs": time.perf_counter() - started} | made)
+
+        conn = sqlite3.connect(db_file)
+        middle = conn.execute(
+            "SELECT start_dt FROM history ORDER BY start_dt "
+            "LIMIT 1 OFFSET ?", (made["events"] // 2,)
+        ).fetchone()
+        specs = [row[0] for row in conn.execute(
+            "SELECT coalesce(grip_spec, grip) FROM history "
+            "ORDER BY random() LIMIT 100"
+        )]
+        hashes = [row[0] for row in conn.execute(
+            "SELECT hash FROM files ORDER BY random() LIMIT ?",
+            (max(files // 100, 1),)
+        )]
+        conn.close()
+
+        # Read-only commands first, then everything changing the DB.
+        for argv in (["latest", "10"], ["search", "Concert", "Live"],
+                     ["search", "--like", "Cut"], ["fsearch", "Documentary"],
+                     ["hashes", "--format=tsv"], ["stats"],
+                     ["analytics", "months", "12"], ["analytics", "top"],
+                     ["cleanup", "--dry-run"]):
+            bench(" ".join(argv), argv)
+        if middle:
+            bench("latest --limit=100 --before",
+                  ["latest", "--limit=100", "--before=" + middle[0]])
+        bench("hash", ["hash"] + media)
+        bench("wrapper", ["wrapper"] + media[:1])
+        bench("add", ["add", media_dir])
+        bench("delete", ["delete"] + specs, 1)
+        bench("purge", ["purge"] + hashes, 1)
+        bench("cleanup", ["cleanup"], 1)
+    if failures:
+        sys.exit("Failed running: {}.".format(", ".join(failures)))
+
+
+BENCHMARKS = {
+    "analytics": bench_analytics,
+    "concurrency": bench_concurrency,
+    "digests": bench_digests,
+    "entrypoints": bench_entrypoints,
+    "escape": bench_escape,
+    "grips": bench_grips,
+    "gripspecs": bench_gripspecs,
+    "locations": bench_locations,
+    "plans": bench_plans,
+    "startup": bench_startup,
+    "timestamps": bench_timestamps,
+}
+
+##### ENTRYPOINTS #####
+
+# mneme <bench> [name [args...]]
+def run_bench():
+    if len(sys.argv) > 1 and sys.argv[1] in BENCHMARKS:
+        BENCHMARKS[sys.argv[1]](sys.argv[2:])
+    elif len(sys.argv) > 1:
+        print("Unknown benchmark, choose from: {}."
+              .format(", ".join(BENCHMARKS)), file=sys.stderr)
+    else:
+        for bench in BENCHMARKS.values():
+            bench([])
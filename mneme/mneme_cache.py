@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# Only refresh an entry's last use timestamp once per this many seconds, so
+# cache hits don't turn into a write each time.
+TOUCH_GRANULARITY = 24 * 3600
+
+import os, sqlite3, time
+from os import path
+
+from mneme_common import CONFIG
+
+
+class digest_cache:
+    def __init__(self, cache_file, max_entries, max_age_days):
+        self.conn = sqlite3.connect(cache_file)
+        self.conn.executescript(
+"""CREATE TABLE IF NOT EXISTS
+digests(
+  filepath TEXT PRIMARY KEY,
+  st_dev INTEGER NOT NULL,
+  st_ino INTEGER NOT NULL,
+  st_size INTEGER NOT NULL,
+  st_mtime_ns INTEGER NOT NULL,
+  hash TEXT NOT NULL,
+  last_used INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS
+counters(
+  name TEXT PRIMARY KEY,
+  value INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS
+digests_idx1 ON digests(last_used);"""
+        )
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 24 * 3600
+        self.now = int(time.time())
+        self.hits = 0
+        self.misses = 0
+        self._touched = []
+        self._stored = []
+
+    def lookup(self, filepath):
+        # Returns the stat key for the file and its cached digest, if any.
+        fullpath = path.abspath(filepath)
+        try:
+            st = os.stat(fullpath)
+        except OSError:
+            return (None, None)
+        key = (fullpath, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+        result = self.conn.execute(
+            """SELECT hash, last_used FROM digests WHERE filepath=?
+            AND st_dev=? AND st_ino=? AND st_size=? AND st_mtime_ns=?""",
+            key
+        ).fetchone()
+        if result:
+            self.hits += 1
+            if self.now - result[1] > TOUCH_GRANULARITY:
+                self._touched.append( (self.now, fullpath) )
+            return (key, result[0])
+        else:
+            self.misses += 1
+            return (key, None)
+
+    def store(self, key, file_hash):
+        self._stored.append(key + (file_hash, self.now))
+
+    def sampling_hash(self, filepath):
+        # Reading the cache, as stats does, shouldn't pull in hashing.
+        from mneme_digests import sampling_hash
+
+        key, file_hash = self.lookup(filepath)
+        if not file_hash:
+            file_hash = sampling_hash(filepath)
+            if key:
+                self.store(key, file_hash)
+        return file_hash
+
+    def evict(self):
+        self.conn.execute(
+            "DELETE FROM digests WHERE last_used < ?",
+            (self.now - self.max_age,)
+        )
+        self.conn.execute(
+            """DELETE FROM digests WHERE filepath IN
+            (SELECT filepath FROM digests ORDER BY last_used DESC
+            LIMIT -1 OFFSET ?)""",
+            (self.max_entries,)
+        )
+
+    def close(self):
+        if self._touched:
+            self.conn.executemany(
+                "UPDATE digests SET last_used=? WHERE filepath=?",
+                self._touched
+            )
+        if self._stored:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO digests VALUES(?, ?, ?, ?, ?, ?, ?)",
+                self._stored
+            )
+            # Only new entries can push us over the limits.
+            self.evict()
+        if self.hits or self.misses:
+            self.conn.executemany(
+                """INSERT INTO counters VALUES(?, ?)
+                ON CONFLICT(name) DO UPDATE SET value=value+excluded.value""",
+                ( ("hits", self.hits), ("misses", self.misses) )
+            )
+        self.conn.commit()
+        self.conn.close()
+
+def open_digest_cache():
+    # Caching can be turned off by setting `digest_cache` to an empty string.
+    if not CONFIG.digest_cache:
+        return None
+    cache_file = CONFIG.digest_cache
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    return digest_cache(
+        cache_file,
+        CONFIG.digest_cache_max_entries,
+        CONFIG.digest_cache_max_age
+    )
+
+def cache_counters():
+    # Hits and misses as counted in the cache, or None if there's none yet
+    # (or it's locked, they're not worth waiting on). Only reads, so stats
+    # never creates the cache or takes a write lock.
+    if not CONFIG.digest_cache:
+        return None
+    uri = CONFIG.digest_cache.absolute().as_uri() + "?mode=ro"
+    try:
+        conn = sqlite3.connect(uri, uri=True, timeout=0)
+        try:
+            result = dict( conn.execute("SELECT name, value FROM counters") )
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return (result.get("hits", 0), result.get("misses", 0))
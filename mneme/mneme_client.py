@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# Seconds to wait for the daemon to take our connection, before falling back
+# to the DB ourselves.
+DAEMON_TIMEOUT = 5.0
+
+import json, os, socket, sys
+
+from mneme_common import CONFIG
+
+
+def no_reply(ex):
+    sys.exit("mneme: no reply from daemon at {}: {}".format(
+        CONFIG.daemon_socket, ex
+    ))
+
+def read_reply(sock):
+    # Messages of the reply as they come in, see `mneme_daemon.reply_stream`.
+    try:
+        for line in sock.makefile("rb"):
+            yield json.loads(line)
+    except (OSError, ValueError) as ex:
+        no_reply(ex)
+
+def call_daemon(argv):
+    # Runs the command through `mneme daemon`, if one is listening. Returns
+    # False when there's none (or it'd rather we ran the command ourselves),
+    # so the caller can run the command itself. Once the daemon took the
+    # command we never fall back, or it would run twice.
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(DAEMON_TIMEOUT)
+    try:
+        try:
+            sock.connect(str(CONFIG.daemon_socket))
+        except (FileNotFoundError, ConnectionRefusedError, TimeoutError):
+            return False
+        # The command takes as long as it takes, same as run directly.
+        sock.settimeout(None)
+        try:
+            # Local times are shown in our timezone, which the daemon might
+            # not share.
+            sock.sendall(json.dumps(
+                {"argv": argv, "tz": os.environ.get("TZ")}
+            ).encode() + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+        except OSError as ex:
+            no_reply(ex)
+
+        # Output is passed on as it streams in, in the order it was written.
+        for message in read_reply(sock):
+            if "declined" in message:
+                return False
+            elif "stdout" in message:
+                sys.stdout.write(message["stdout"])
+            elif "stderr" in message:
+                sys.stdout.flush()
+                sys.stderr.write(message["stderr"])
+            elif "status" in message:
+                break
+        else:
+            no_reply("connection closed")
+    finally:
+        sock.close()
+
+    if message["status"]:
+        sys.stdout.flush()
+        sys.exit(message["status"])
+    return True
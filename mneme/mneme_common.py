@@ -1,18 +1,51 @@
 #!/usr/bin/env python
 
-import sqlite3, tomllib
-from pathlib import Path
+# Only what every command needs is imported up front, sqlite3, tomllib and
+# pathlib are imported once they're actually used.
+import time
+
+from mneme_sql import (
+    COPY_TABLE, DROP_TABLE, DROP_VIEW, FOREIGN_KEY_CHECK, GET_META,
+    RENAME_TABLE, SET_META, STATEMENT_CACHE_SIZE, TABLE_COLUMNS,
+    TABLE_DEPENDENTS, TABLE_SQL, VIEWS
+)
 
 VERSION = "0.8.0"
 
 
 class config:
+    # Loaded on first use, so commands that never look at the config don't pay
+    # for parsing it (or for creating it, the first time around).
     def __init__(self):
+        self.conf = None
+
+    def load(self):
+        import tomllib
+        from pathlib import Path
+
         default_config = """# Configuration file for the media history application, mneme.
 db_file = "~/.local/share/mneme_db.sqlite"
 media_player = "mpv"
 datetime_display_format = "%Y-%m-%d %H:%M:%S %Z"
 latest_default_limit = 10
+hash_workers = 4
+digest_cache = "~/.cache/mneme_digests.sqlite"
+digest_cache_max_entries = 100000
+digest_cache_max_age = 180
+busy_retries = 5
+busy_backoff = 0.05
+log_timings = false
+daemon_socket = "~/.cache/mneme.sock"
+
+# PRAGMAs applied to every connection to db_file, leave empty for SQLite's
+# default. The journal mode is left alone on read-only connections.
+[sqlite]
+journal_mode = "wal"
+synchronous = "normal"
+busy_timeout = 5000
+cache_size = -8192
+mmap_size = 268435456
+temp_store = "memory"
 """
         a = Path.home() / ".config" / "mneme.toml"
         b = Path.home() / ".mneme.toml"
@@ -25,27 +58,36 @@ latest_default_limit = 10
                 f.write(default_config)
             config_file = a
 
+        # Start from the defaults, so older config files missing newer
+        # settings still work.
+        self.conf = tomllib.loads(default_config)
         with (open(config_file, "rb") as f):
-            self.conf = tomllib.load(f)
-        # Expand ~ in db_file path:
-        self.conf["db_file"] = Path(self.conf["db_file"]).expanduser()
+            for key, value in tomllib.load(f).items():
+                if isinstance(value, dict) and key in self.conf:
+                    self.conf[key] |= value
+                else:
+                    self.conf[key] = value
+        # Expand ~ in db_file, digest_cache and daemon_socket paths:
+        for key in ("db_file", "digest_cache", "daemon_socket"):
+            if self.conf[key]:
+                self.conf[key] = Path(self.conf[key]).expanduser()
 
     def __getattr__(self, name):
-        val = self.conf.get(name)
-        if val:
-            return val
+        if self.conf is None:
+            self.load()
+        if name in self.conf:
+            return self.conf[name]
         else:
             raise AttributeError(
                 "'config' object has no attribute '{}'".format(name)
             )
 CONFIG = config()
 
-def initialize_sqlite():
-    db_conn = sqlite3.connect(CONFIG.db_file)
-    db_conn.executescript(
-"""PRAGMA foreign_keys = ON;
-
-CREATE TABLE IF NOT EXISTS
+# Schema migrations, in order. The DB's `user_version` holds the number of
+# migrations applied to it, so we only ever run DDL when the schema is behind.
+MIGRATIONS = (
+# 1: Initial schema.
+"""CREATE TABLE IF NOT EXISTS
 files(
   id INTEGER PRIMARY KEY ASC,
   hash TEXT NOT NULL UNIQUE,
@@ -91,7 +133,561 @@ CREATE INDEX IF NOT EXISTS
 history_idx3 ON history(grip);
 
 CREATE UNIQUE INDEX IF NOT EXISTS
-filetrack_uniq ON filetrack(file_id, filepath);"""
+filetrack_uniq ON filetrack(file_id, filepath);""",
+
+# 2: Full-text search indices over filepaths and filenames.
+"""CREATE VIRTUAL TABLE
+filetrack_fts USING fts5(
+  filepath,
+  content='filetrack', content_rowid='id',
+  tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+CREATE VIRTUAL TABLE
+files_fts USING fts5(
+  filenames,
+  content='files', content_rowid='id',
+  tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+CREATE TRIGGER
+filetrack_fts_ai AFTER INSERT ON filetrack BEGIN
+  INSERT INTO filetrack_fts(rowid, filepath) VALUES(new.id, new.filepath);
+END;
+
+CREATE TRIGGER
+filetrack_fts_ad AFTER DELETE ON filetrack BEGIN
+  INSERT INTO filetrack_fts(filetrack_fts, rowid, filepath)
+  VALUES('delete', old.id, old.filepath);
+END;
+
+CREATE TRIGGER
+filetrack_fts_au AFTER UPDATE OF filepath ON filetrack BEGIN
+  INSERT INTO filetrack_fts(filetrack_fts, rowid, filepath)
+  VALUES('delete', old.id, old.filepath);
+  INSERT INTO filetrack_fts(rowid, filepath) VALUES(new.id, new.filepath);
+END;
+
+CREATE TRIGGER
+files_fts_ai AFTER INSERT ON files BEGIN
+  INSERT INTO files_fts(rowid, filenames) VALUES(new.id, new.filenames);
+END;
+
+CREATE TRIGGER
+files_fts_ad AFTER DELETE ON files BEGIN
+  INSERT INTO files_fts(files_fts, rowid, filenames)
+  VALUES('delete', old.id, old.filenames);
+END;
+
+CREATE TRIGGER
+files_fts_au AFTER UPDATE OF filenames ON files BEGIN
+  INSERT INTO files_fts(files_fts, rowid, filenames)
+  VALUES('delete', old.id, old.filenames);
+  INSERT INTO files_fts(rowid, filenames) VALUES(new.id, new.filenames);
+END;
+
+INSERT INTO filetrack_fts(filetrack_fts) VALUES('rebuild');
+
+INSERT INTO files_fts(files_fts) VALUES('rebuild');""",
+
+# 3: Grip counts maintained incrementally, replacing the v_grips view.
+"""DROP VIEW IF EXISTS v_grips;
+
+CREATE TABLE
+grip_counts(
+  grip TEXT PRIMARY KEY,
+  grip_count INTEGER NOT NULL
+) WITHOUT ROWID;
+
+INSERT INTO grip_counts
+SELECT grip, count(grip) FROM history
+GROUP BY grip;
+
+CREATE TRIGGER
+grip_counts_ai AFTER INSERT ON history BEGIN
+  INSERT INTO grip_counts VALUES(new.grip, 1)
+  ON CONFLICT(grip) DO UPDATE SET grip_count=grip_count+1;
+END;
+
+CREATE TRIGGER
+grip_counts_ad AFTER DELETE ON history BEGIN
+  UPDATE grip_counts SET grip_count=grip_count-1 WHERE grip=old.grip;
+  DELETE FROM grip_counts WHERE grip=old.grip AND grip_count=0;
+END;
+
+CREATE TRIGGER
+grip_counts_au AFTER UPDATE OF grip ON history
+WHEN old.grip IS NOT new.grip BEGIN
+  UPDATE grip_counts SET grip_count=grip_count-1 WHERE grip=old.grip;
+  DELETE FROM grip_counts WHERE grip=old.grip AND grip_count=0;
+  INSERT INTO grip_counts VALUES(new.grip, 1)
+  ON CONFLICT(grip) DO UPDATE SET grip_count=grip_count+1;
+END;""",
+
+# 4: Filenames moved out of the files.filenames JSON array, into their own
+#    table.
+"""CREATE TABLE
+filenames(
+  id INTEGER PRIMARY KEY ASC,
+  file_id INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  first_seen_dt TEXT NOT NULL,
+  FOREIGN KEY(file_id) REFERENCES files(id) ON DELETE CASCADE
+);
+
+CREATE UNIQUE INDEX
+filenames_uniq ON filenames(file_id, name);
+
+INSERT OR IGNORE INTO filenames(file_id, name, first_seen_dt)
+SELECT files.id, names.value, coalesce(
+  (SELECT min(first_seen_dt) FROM filetrack WHERE file_id=files.id),
+  strftime('%Y-%m-%dT%H:%M:%f000Z')
+)
+FROM files, json_each(files.filenames) AS names
+ORDER BY files.id, names.key;
+
+DROP TRIGGER files_fts_ai;
+
+DROP TRIGGER files_fts_ad;
+
+DROP TRIGGER files_fts_au;
+
+DROP TABLE files_fts;
+
+ALTER TABLE files DROP COLUMN filenames;
+
+CREATE VIRTUAL TABLE
+filenames_fts USING fts5(
+  name,
+  content='filenames', content_rowid='id',
+  tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+CREATE TRIGGER
+filenames_fts_ai AFTER INSERT ON filenames BEGIN
+  INSERT INTO filenames_fts(rowid, name) VALUES(new.id, new.name);
+END;
+
+CREATE TRIGGER
+filenames_fts_ad AFTER DELETE ON filenames BEGIN
+  INSERT INTO filenames_fts(filenames_fts, rowid, name)
+  VALUES('delete', old.id, old.name);
+END;
+
+CREATE TRIGGER
+filenames_fts_au AFTER UPDATE OF name ON filenames BEGIN
+  INSERT INTO filenames_fts(filenames_fts, rowid, name)
+  VALUES('delete', old.id, old.name);
+  INSERT INTO filenames_fts(rowid, name) VALUES(new.id, new.name);
+END;
+
+INSERT INTO filenames_fts(filenames_fts) VALUES('rebuild');
+
+CREATE TRIGGER
+filenames_renames AFTER INSERT ON filenames
+WHEN EXISTS
+  (SELECT 1 FROM filenames WHERE file_id=new.file_id AND id<>new.id)
+BEGIN
+  UPDATE files SET renames=renames+1 WHERE id=new.file_id;
+END;""",
+
+# 5: Index for looking up history by file, as cleanup does.
+"""CREATE INDEX IF NOT EXISTS
+history_idx4 ON history(file_id);""",
+
+# 6: Stat signature of filepaths, for detecting changed files without hashing.
+"""ALTER TABLE filetrack ADD COLUMN st_size INTEGER;
+
+ALTER TABLE filetrack ADD COLUMN st_mtime_ns INTEGER;
+
+CREATE INDEX IF NOT EXISTS
+filetrack_idx1 ON filetrack(filepath);""",
+
+# 7: Settings of the DB itself, such as how timestamps are stored (see
+#    `convert_timestamps`).
+"""CREATE TABLE
+meta(
+  name TEXT PRIMARY KEY,
+  value
+) WITHOUT ROWID;
+
+INSERT INTO meta VALUES('timestamps', 'text');""",
+
+# 8: Listening analytics, play time rolled up per (local) day and per file
+#    from finished events, and an index for ranking files by renames. The
+#    rollups are rebuilt by `mneme analytics --rebuild`.
+"""CREATE TABLE
+play_days(
+  day TEXT PRIMARY KEY,
+  events INTEGER NOT NULL,
+  play_secs INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE
+file_plays(
+  file_id INTEGER PRIMARY KEY,
+  events INTEGER NOT NULL,
+  play_secs INTEGER NOT NULL,
+  FOREIGN KEY(file_id) REFERENCES files(id) ON DELETE CASCADE
+);
+
+CREATE INDEX
+file_plays_idx ON file_plays(play_secs);
+
+CREATE INDEX
+files_idx_renames ON files(renames) WHERE renames > 0;
+
+CREATE TRIGGER
+rollups_ai AFTER INSERT ON history
+WHEN new.play_secs NOT NULL BEGIN
+  INSERT INTO play_days VALUES(CASE typeof(new.start_dt)
+    WHEN 'integer' THEN date(new.start_dt / 1000000, 'unixepoch', 'localtime')
+    ELSE date(new.start_dt, 'localtime') END, 1, new.play_secs)
+  ON CONFLICT(day) DO UPDATE SET
+  events=events+1, play_secs=play_secs+excluded.play_secs;
+  INSERT INTO file_plays VALUES(new.file_id, 1, new.play_secs)
+  ON CONFLICT(file_id) DO UPDATE SET
+  events=events+1, play_secs=play_secs+excluded.play_secs;
+END;
+
+CREATE TRIGGER
+rollups_ad AFTER DELETE ON history
+WHEN old.play_secs NOT NULL BEGIN
+  UPDATE play_days SET events=events-1, play_secs=play_secs-old.play_secs
+  WHERE day=CASE typeof(old.start_dt)
+    WHEN 'integer' THEN date(old.start_dt / 1000000, 'unixepoch', 'localtime')
+    ELSE date(old.start_dt, 'localtime') END;
+  DELETE FROM play_days WHERE events=0;
+  UPDATE file_plays SET events=events-1, play_secs=play_secs-old.play_secs
+  WHERE file_id=old.file_id;
+  DELETE FROM file_plays WHERE file_id=old.file_id AND events=0;
+END;
+
+CREATE TRIGGER
+rollups_au_old AFTER UPDATE OF file_id, start_dt, play_secs ON history
+WHEN old.play_secs NOT NULL BEGIN
+  UPDATE play_days SET events=events-1, play_secs=play_secs-old.play_secs
+  WHERE day=CASE typeof(old.start_dt)
+    WHEN 'integer' THEN date(old.start_dt / 1000000, 'unixepoch', 'localtime')
+    ELSE date(old.start_dt, 'localtime') END;
+  DELETE FROM play_days WHERE events=0;
+  UPDATE file_plays SET events=events-1, play_secs=play_secs-old.play_secs
+  WHERE file_id=old.file_id;
+  DELETE FROM file_plays WHERE file_id=old.file_id AND events=0;
+END;
+
+CREATE TRIGGER
+rollups_au_new AFTER UPDATE OF file_id, start_dt, play_secs ON history
+WHEN new.play_secs NOT NULL BEGIN
+  INSERT INTO play_days VALUES(CASE typeof(new.start_dt)
+    WHEN 'integer' THEN date(new.start_dt / 1000000, 'unixepoch', 'localtime')
+    ELSE date(new.start_dt, 'localtime') END, 1, new.play_secs)
+  ON CONFLICT(day) DO UPDATE SET
+  events=events+1, play_secs=play_secs+excluded.play_secs;
+  INSERT INTO file_plays VALUES(new.file_id, 1, new.play_secs)
+  ON CONFLICT(file_id) DO UPDATE SET
+  events=events+1, play_secs=play_secs+excluded.play_secs;
+END;
+
+INSERT INTO play_days
+SELECT CASE typeof(start_dt)
+  WHEN 'integer' THEN date(start_dt / 1000000, 'unixepoch', 'localtime')
+  ELSE date(start_dt, 'localtime') END AS day, count(id), sum(play_secs)
+FROM history WHERE play_secs NOT NULL
+GROUP BY day;
+
+INSERT INTO file_plays
+SELECT file_id, count(id), sum(play_secs)
+FROM history WHERE play_secs NOT NULL
+GROUP BY file_id;""",
+
+# 9: Shortest grip-spec telling each event apart from others with the same
+#    grip, kept up to date by triggers. Only set for grips shared by several
+#    events, all others go by their grip alone. Events are looked up by grip
+#    and start_dt together, replacing the index on grip alone.
+"""ALTER TABLE history ADD COLUMN grip_spec TEXT;
+
+DROP INDEX history_idx3;
+
+CREATE INDEX IF NOT EXISTS
+history_idx5 ON history(grip, start_dt);
+
+CREATE VIEW IF NOT EXISTS
+v_grip_specs(id, grip, grip_spec)
+AS SELECT id, grip, CASE WHEN n = 1 THEN NULL
+  ELSE substr(replace(day, '-', '.') || '.', 1, 5 + 3 * max(
+    CASE WHEN substr(day, 1, 7) = substr(prev_day, 1, 7) THEN 2
+    WHEN substr(day, 1, 4) = substr(prev_day, 1, 4) THEN 1 ELSE 0 END,
+    CASE WHEN substr(day, 1, 7) = substr(next_day, 1, 7) THEN 2
+    WHEN substr(day, 1, 4) = substr(next_day, 1, 4) THEN 1 ELSE 0 END
+  )) || grip END
+FROM (
+  SELECT id, grip, day, count(id) OVER (PARTITION BY grip) AS n,
+  lag(day) OVER w AS prev_day, lead(day) OVER w AS next_day
+  FROM (
+    SELECT id, grip, start_dt, CASE typeof(start_dt)
+      WHEN 'integer' THEN date(start_dt / 1000000, 'unixepoch')
+      ELSE substr(start_dt, 1, 10) END AS day
+    FROM history
+  )
+  WINDOW w AS (PARTITION BY grip ORDER BY start_dt, id)
+);
+
+CREATE TRIGGER
+grip_specs_ai AFTER INSERT ON history
+WHEN new.grip_spec NOT NULL OR EXISTS
+  (SELECT 1 FROM history WHERE grip=new.grip AND id<>new.id)
+BEGIN
+  UPDATE history SET grip_spec=v.grip_spec FROM v_grip_specs AS v
+  WHERE v.grip=new.grip AND history.id=v.id
+  AND history.grip_spec IS NOT v.grip_spec;
+END;
+
+CREATE TRIGGER
+grip_specs_ad AFTER DELETE ON history
+WHEN old.grip_spec NOT NULL BEGIN
+  UPDATE history SET grip_spec=v.grip_spec FROM v_grip_specs AS v
+  WHERE v.grip=old.grip AND history.id=v.id
+  AND history.grip_spec IS NOT v.grip_spec;
+END;
+
+CREATE TRIGGER
+grip_specs_au_old AFTER UPDATE OF grip, start_dt ON history
+WHEN old.grip_spec NOT NULL BEGIN
+  UPDATE history SET grip_spec=v.grip_spec FROM v_grip_specs AS v
+  WHERE v.grip=old.grip AND history.id=v.id
+  AND history.grip_spec IS NOT v.grip_spec;
+END;
+
+CREATE TRIGGER
+grip_specs_au_new AFTER UPDATE OF grip, start_dt ON history
+WHEN old.grip_spec NOT NULL OR EXISTS
+  (SELECT 1 FROM history WHERE grip=new.grip AND id<>new.id)
+BEGIN
+  UPDATE history SET grip_spec=v.grip_spec FROM v_grip_specs AS v
+  WHERE v.grip=new.grip AND history.id=v.id
+  AND history.grip_spec IS NOT v.grip_spec;
+END;
+
+UPDATE history SET grip_spec=v.grip_spec FROM v_grip_specs AS v
+WHERE history.id=v.id AND v.grip_spec NOT NULL;""",
+)
+
+# Ways of storing timestamps, as ISO 8601 text or as integer microseconds
+# since the epoch, with the column type for each.
+TIMESTAMP_MODES = {"text": "TEXT", "int": "INTEGER"}
+# Timestamp columns, by table.
+TIMESTAMP_COLUMNS = {
+    "filenames": ("first_seen_dt",),
+    "filetrack": ("first_seen_dt", "last_seen_dt"),
+    "history": ("start_dt", "stop_dt"),
+}
+
+# Connection settings that can be set in the config's [sqlite] table.
+SQLITE_PRAGMAS = (
+    "journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size",
+    "temp_store"
+)
+
+def split_statements(script):
+    import sqlite3
+
+    stmt = ""
+    for part in script.split(";"):
+        stmt += part + ";"
+        if sqlite3.complete_statement(stmt):
+            yield stmt.strip()
+            stmt = ""
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_migrations(cur):
+    # Check (again) once we hold the write lock, another mneme process might've
+    # beaten us to it.
+    for script in MIGRATIONS[schema_version(cur):]:
+        for stmt in split_statements(script):
+            cur.execute(stmt)
+    cur.execute("PRAGMA user_version = {}".format(len(MIGRATIONS)))
+
+def migrate(conn):
+    write_transaction(conn, apply_migrations)
+
+def timestamp_mode(conn):
+    return conn.execute(GET_META, ("timestamps",)).fetchone()[0]
+
+def rebuild_table(cur, table, columns, col_type, convert):
+    # Recreates the table with the columns retyped, their values passed
+    # through the `convert` SQL function, keeping its indices, triggers and
+    # views on it. Foreign keys have to be off, or dropping the old table
+    # cascades.
+    import re
+
+    table_sql = cur.execute(TABLE_SQL, (table,)).fetchone()[0]
+    dependents = cur.execute(TABLE_DEPENDENTS, (table,)).fetchall()
+    # Views can't outlive the table, or renaming the new one fails.
+    views = [row for row in cur.execute(VIEWS)
+             if re.search(r"\b{}\b".format(table), row[1])]
+    names = [row[0] for row in cur.execute(TABLE_COLUMNS, (table,))]
+
+    new_table = table + "_rebuild"
+    table_sql = re.sub(
+        r'\A(CREATE TABLE\s+)"?{}\b"?'.format(table), r"\g<1>" + new_table,
+        table_sql
+    )
+    table_sql = re.sub(
+        r"\b({})\s+(TEXT|INTEGER)\b".format("|".join(columns)),
+        r"\1 " + col_type, table_sql
     )
-    db_conn.commit()
+    cur.execute(table_sql)
+    cur.execute(COPY_TABLE.format(new_table, ", ".join(
+        "{}({})".format(convert, name) if name in columns else name
+        for name in names
+    ), table))
+    for name, view_sql in views:
+        cur.execute(DROP_VIEW.format(name))
+    cur.execute(DROP_TABLE.format(table))
+    cur.execute(RENAME_TABLE.format(new_table, table))
+    for row in views + dependents:
+        cur.execute(row[-1])
+
+def rebuild_timestamps(cur, mode):
+    if timestamp_mode(cur) == mode:
+        return False
+    for table, columns in TIMESTAMP_COLUMNS.items():
+        rebuild_table(
+            cur, table, columns, TIMESTAMP_MODES[mode], "convert_timestamp"
+        )
+    cur.execute(SET_META, ("timestamps", mode))
+    if cur.execute(FOREIGN_KEY_CHECK).fetchone():
+        raise ValueError("Foreign keys broken while converting, giving up")
+    return True
+
+def convert_timestamps(conn, mode):
+    # Switches the DB over to storing timestamps as text or integers, in one
+    # transaction. Returns False if it already does.
+    from mnemedt import mnemedt
+
+    if mode == "int":
+        convert = lambda value: int(mnemedt.fromdb(value))
+    else:
+        convert = lambda value: str(mnemedt.fromdb(value))
+    conn.create_function(
+        "convert_timestamp", 1,
+        lambda value: None if value is None else convert(value),
+        deterministic=True
+    )
+
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        converted = write_transaction(conn, rebuild_timestamps, mode)
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+    if converted:
+        set_timestamp_mode(mode)
+    return converted
+
+# How the DB we're connected to stores timestamps, see `to_db`.
+_int_timestamps = False
+
+def set_timestamp_mode(mode):
+    global _int_timestamps
+    _int_timestamps = mode == "int"
+
+def to_db(timestamp):
+    # A mnemedt as stored in the DB, for use as query parameter.
+    if _int_timestamps:
+        return int(timestamp)
+    else:
+        return str(timestamp)
+
+def apply_profile(conn, readonly=False):
+    # Sets up the connection as configured in [sqlite], see `SQLITE_PRAGMAS`.
+    for name in SQLITE_PRAGMAS:
+        value = CONFIG.sqlite.get(name, "")
+        if value == "" or (readonly and name == "journal_mode"):
+            continue
+        if not (isinstance(value, int) or str(value).isalnum()):
+            raise ValueError(
+                "Invalid value for {} in [sqlite]: {!r}".format(name, value)
+            )
+        conn.execute("PRAGMA {} = {}".format(name, value))
+
+# Read-only connection handed out to everyone, when long-running.
+_shared_readonly = None
+
+def share_readonly(conn):
+    # From here on, read-only connections are all this one connection (see
+    # `mneme daemon`), instead of opening the DB again each time.
+    global _shared_readonly
+    _shared_readonly = conn
+
+def initialize_sqlite(readonly=False):
+    import sqlite3
+
+    if readonly and _shared_readonly:
+        return _shared_readonly
+    if readonly:
+        # Read-only connections never take write locks, but they can only be
+        # made once the DB exists and is up to date.
+        uri = CONFIG.db_file.absolute().as_uri() + "?mode=ro"
+        try:
+            db_conn = sqlite3.connect(
+                uri, uri=True, cached_statements=STATEMENT_CACHE_SIZE
+            )
+            apply_profile(db_conn, readonly=True)
+            if schema_version(db_conn) >= len(MIGRATIONS):
+                set_timestamp_mode(timestamp_mode(db_conn))
+                return db_conn
+            db_conn.close()
+        except sqlite3.OperationalError:
+            pass
+        initialize_sqlite().close()
+        db_conn = sqlite3.connect(
+            uri, uri=True, cached_statements=STATEMENT_CACHE_SIZE
+        )
+        apply_profile(db_conn, readonly=True)
+        set_timestamp_mode(timestamp_mode(db_conn))
+        return db_conn
+
+    db_conn = sqlite3.connect(
+        CONFIG.db_file, cached_statements=STATEMENT_CACHE_SIZE
+    )
+    apply_profile(db_conn)
+    db_conn.execute("PRAGMA foreign_keys = ON")
+    if schema_version(db_conn) < len(MIGRATIONS):
+        migrate(db_conn)
+    set_timestamp_mode(timestamp_mode(db_conn))
     return db_conn
+
+def write_transaction(conn, fn, *args):
+    # Calls fn with a cursor in a write transaction, returning what it does.
+    # The write lock is taken up front, so nothing sneaks in between what fn
+    # reads and writes. On any error we roll back, leaving the connection
+    # ready for another go (see `retry_busy`).
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(conn.cursor(), *args)
+        conn.commit()
+        return result
+    except:
+        conn.rollback()
+        raise
+
+def retry_busy(fn, *args, on_retry=None):
+    # Calls fn, retrying with exponential backoff for as long as the DB is
+    # locked by others, but at most `busy_retries` times.
+    import sqlite3
+
+    delay = CONFIG.busy_backoff
+    for attempt in range(CONFIG.busy_retries + 1):
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as ex:
+            if (ex.sqlite_errorcode != sqlite3.SQLITE_BUSY or
+                    attempt == CONFIG.busy_retries):
+                raise
+        if on_retry:
+            on_retry(delay)
+        time.sleep(delay)
+        delay *= 2
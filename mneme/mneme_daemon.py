@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+import asyncio, json, os, signal, socket, sqlite3, stat, sys, threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from mneme_common import (
+    CONFIG, initialize_sqlite, set_timestamp_mode, share_readonly,
+    timestamp_mode
+)
+from mneme_query import (
+    now_playing, print_np, run_latest, run_search, run_stats
+)
+from mneme_sql import DATA_VERSION
+
+
+class db_state:
+    # What we keep of the DB between requests, the currently playing event and
+    # how timestamps are stored, only queried again once the DB changed.
+    def __init__(self, conn):
+        self.conn = conn
+        self.version = None
+        self.playing = None
+
+    def refresh(self):
+        version = self.conn.execute(DATA_VERSION).fetchone()[0]
+        if version != self.version:
+            set_timestamp_mode(timestamp_mode(self.conn))
+            self.playing = now_playing(self.conn)
+            self.version = version
+
+
+##### SERVER #####
+
+# Output is sent on to clients once this many characters of it piled up (or
+# the command flushes), so big results stream instead of sitting in memory.
+REPLY_CHUNK_SIZE = 64 * 1024
+
+# The reply each thread is currently writing its output to, if any.
+_serving = threading.local()
+
+class routed_stream:
+    # Stands in for sys.stdout or sys.stderr, passing writes made while
+    # serving a request on to its reply.
+    def __init__(self, name, stream):
+        self.name = name
+        self.stream = stream
+
+    def write(self, s):
+        reply = getattr(_serving, "reply", None)
+        if reply:
+            return reply.write(self.name, s)
+        return self.stream.write(s)
+
+    def flush(self):
+        reply = getattr(_serving, "reply", None)
+        if reply:
+            reply.flush()
+        else:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class reply_stream:
+    # Output of a command, handed to send as JSON lines of {"stdout": ...} or
+    # {"stderr": ...}, in the order it was written.
+    def __init__(self, send):
+        self.send = send
+        self.parts = []
+        self.size = 0
+
+    def write(self, name, s):
+        if self.parts and self.parts[-1][0] == name:
+            self.parts[-1][1].append(s)
+        else:
+            self.parts.append( (name, [s]) )
+        self.size += len(s)
+        if self.size >= REPLY_CHUNK_SIZE:
+            self.flush()
+        return len(s)
+
+    def flush(self):
+        if self.parts:
+            data = b"".join(
+                json.dumps({name: "".join(texts)}).encode() + b"\n"
+                for name, texts in self.parts
+            )
+            self.parts.clear()
+            self.size = 0
+            self.send(data)
+
+def run_captured(fn, reply):
+    # Runs an entrypoint like the CLI would, its output going to the reply.
+    # Returns its exit status.
+    status = 0
+    _serving.reply = reply
+    try:
+        fn()
+    except SystemExit as ex:
+        if isinstance(ex.code, int):
+            status = ex.code
+        elif ex.code is not None:
+            print(ex.code, file=sys.stderr)
+            status = 1
+    except BrokenPipeError:
+        # The client went away (think `mneme search | head`), stop here.
+        status = 1
+    except sqlite3.Error as ex:
+        print("mneme: {}".format(ex), file=sys.stderr)
+        status = 1
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        _serving.reply = None
+    try:
+        reply.flush()
+    except BrokenPipeError:
+        pass
+    return status
+
+def blocking_send(loop, writer):
+    # For commands run off the event loop, waits until the client took each
+    # chunk, so a slow client slows the command down instead of us buffering
+    # everything. A client that's gone shows up as a broken pipe, as it would
+    # running the command directly.
+    async def send(data):
+        writer.write(data)
+        await writer.drain()
+
+    def send_now(data):
+        try:
+            asyncio.run_coroutine_threadsafe(send(data), loop).result()
+        except (ConnectionError, RuntimeError) as ex:
+            raise BrokenPipeError("client went away") from ex
+    return send_now
+
+def open_worker():
+    # Queries get a thread and a connection of their own, keeping the event
+    # loop free for `playing`. They run one at a time, as they go by sys.argv.
+    conn = initialize_sqlite(readonly=True)
+    share_readonly(conn)
+    _serving.state = db_state(conn)
+
+def run_query(fn, argv, send):
+    _serving.state.refresh()
+    sys.argv = argv
+    return run_captured(fn, reply_stream(send))
+
+def make_commands(state):
+    def playing():
+        if state.playing:
+            print_np(state.playing)
+
+    queries = {
+        "latest": run_latest,
+        "search": run_search,
+        "stats": run_stats,
+    }
+    queries |= {"l": run_latest, "s": run_search}
+    return ({"playing": playing, "np": playing}, queries)
+
+async def serve_client(state, commands, worker, reader, writer):
+    loop = asyncio.get_running_loop()
+    inline, queries = commands
+    try:
+        request = json.loads(await reader.readline())
+        argv = [str(arg) for arg in request["argv"]]
+        if request.get("tz") != os.environ.get("TZ"):
+            # Local times would come out in our timezone instead of the
+            # client's, so it's better off running the command itself.
+            writer.write(json.dumps({"declined": "timezone"}).encode() + b"\n")
+        elif argv and argv[0] in inline:
+            # Answered from what we already know, this doesn't wait on
+            # queries running in the worker.
+            state.refresh()
+            chunks = []
+            status = run_captured(inline[argv[0]], reply_stream(chunks.append))
+            writer.write(b"".join(chunks))
+            writer.write(json.dumps({"status": status}).encode() + b"\n")
+        elif argv and argv[0] in queries:
+            status = await loop.run_in_executor(
+                worker, run_query, queries[argv[0]], argv,
+                blocking_send(loop, writer)
+            )
+            writer.write(json.dumps({"status": status}).encode() + b"\n")
+        else:
+            writer.write(json.dumps({
+                "stderr": "mneme: daemon can't run that command.\n"
+            }).encode() + b"\n")
+            writer.write(json.dumps({"status": 1}).encode() + b"\n")
+        await writer.drain()
+    except (ValueError, KeyError, TypeError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+def clear_stale_socket(sock_path):
+    # A socket file nobody listens on is left over from an earlier daemon.
+    # Anything else there is none of our business, say a mistyped setting
+    # pointing at someone's file.
+    try:
+        mode = os.lstat(sock_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        sys.exit("mneme: {} exists and isn't a socket, not touching it."
+                 .format(sock_path))
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(sock_path)
+    except ConnectionRefusedError:
+        os.unlink(sock_path)
+        return
+    finally:
+        probe.close()
+    sys.exit("mneme: a daemon is already listening on {}".format(sock_path))
+
+async def serve(sock_path, state, worker):
+    commands = make_commands(state)
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set_result, None)
+
+    old_umask = os.umask(0o177)
+    try:
+        server = await asyncio.start_unix_server(
+            lambda r, w: serve_client(state, commands, worker, r, w),
+            sock_path
+        )
+    finally:
+        os.umask(old_umask)
+    print("mneme: daemon listening on {}".format(sock_path), file=sys.stderr)
+    try:
+        async with server:
+            await stop
+    finally:
+        os.unlink(sock_path)
+
+
+##### ENTRYPOINTS #####
+
+# mneme <daemon>
+def run_daemon():
+    if not CONFIG.daemon_socket:
+        sys.exit("mneme: set daemon_socket in the config to run the daemon.")
+    sock_path = str(CONFIG.daemon_socket)
+    clear_stale_socket(sock_path)
+
+    # Connections are kept warm, one for what's playing and one in the worker
+    # for everything else.
+    conn = initialize_sqlite(readonly=True)
+    sys.stdout = routed_stream("stdout", sys.stdout)
+    sys.stderr = routed_stream("stderr", sys.stderr)
+    with ThreadPoolExecutor(max_workers=1, initializer=open_worker) as worker:
+        asyncio.run(serve(sock_path, db_state(conn), worker))
+    conn.close()
+
+if __name__ == "__main__":
+    run_daemon()
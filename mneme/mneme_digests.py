@@ -10,18 +10,29 @@ CK_BALANCE = (10, 6)
 # Digest size for the history handle, in bytes.
 HIST_HANDLE_SIZE = 4
 
-import math
+import math, os, stat, threading
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 from hashlib import blake2b
 from os import path
 
+from mnemedt import mnemedt
+
+# How many file sizes to keep sample plans around for.
+PLAN_CACHE_SIZE = 1024
+
+_buffers = threading.local()
 
 def insert_into(l, value):
-    for i in range(len(l) - 1):
-        j = i + 1
-        if value > l[i] and value < l[j]:
-            l.insert(j, value)
-            return
+    # Only ever inserts strictly between two locations, so a value equal to one
+    # already there is dropped. Digests depend on this, don't "fix" it.
+    i = bisect_left(l, value)
+    if 0 < i < len(l) and l[i] != value:
+        l.insert(i, value)
 
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
 def sample_locations(filesize):
     end_location = filesize - CK_SAMPLE_SIZE
     # Prepend sample location at file's beginning.
@@ -36,7 +47,21 @@ def sample_locations(filesize):
     # Insert sample location at midpoint of the file.
     middle = math.floor(filesize / 2)
     insert_into(skip_list, middle)
-    return skip_list
+    return tuple(skip_list)
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def sample_plan(filesize):
+    # Sample locations coalesced into runs of overlapping or adjacent reads, as
+    # (offset, length, sample offsets within the run), in hashing order.
+    runs = []
+    for loc in sample_locations(filesize):
+        if runs and runs[-1][0] <= loc <= runs[-1][0] + runs[-1][1]:
+            start, length, samples = runs[-1]
+            length = max(length, loc - start + CK_SAMPLE_SIZE)
+            runs[-1] = (start, length, samples + (loc - start,))
+        else:
+            runs.append( (loc, CK_SAMPLE_SIZE, (0,)) )
+    return tuple(runs)
 
 def checked_getsize(filepath):
     fsize = path.getsize(filepath)
@@ -49,17 +74,58 @@ def checked_getsize(filepath):
     else:
         return fsize
 
-def _do_sampling(hasher, filepath, filesize):
+def _sample_seek(hasher, f, filesize):
+    for loc in sample_locations(filesize):
+         f.seek(loc)
+         hasher.update(f.read(CK_SAMPLE_SIZE))
+
+def _sample_buffer(size):
+    # One buffer per thread, reused for every run we read.
+    buf = getattr(_buffers, "view", None)
+    if buf is None or len(buf) < size:
+        buf = _buffers.view = memoryview(bytearray(size))
+    return buf
+
+def _sample_preadv(hasher, f, filesize):
+    fd = f.fileno()
+    plan = sample_plan(filesize)
+    buf = _sample_buffer(max(run[1] for run in plan))
+    if hasattr(os, "posix_fadvise"):
+        # No use reading ahead for our sparse pattern, instead let the kernel
+        # know up front which parts we'll want.
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_RANDOM)
+        for offset, length, samples in plan:
+            if offset >= 0:
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+
+    for offset, length, samples in plan:
+        # Same as buffered reads, only stop short at the end of the file.
+        n = 0
+        while n < length:
+            got = os.preadv(fd, [buf[n:length]], offset + n)
+            if got == 0:
+                break
+            n += got
+        for rel in samples:
+            hasher.update(buf[rel:min(rel + CK_SAMPLE_SIZE, n)])
+
+def _pick_sampler(f):
+    if hasattr(os, "preadv") and stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+        return _sample_preadv
+    else:
+        return _sample_seek
+
+def _do_sampling(hasher, filepath, filesize, sampler=None):
     with open(filepath, 'rb') as f:
-        for loc in sample_locations(filesize):
-             f.seek(loc)
-             hasher.update(f.read(CK_SAMPLE_SIZE))
+        if sampler is None:
+            sampler = _pick_sampler(f)
+        sampler(hasher, f, filesize)
 
-def sampling_hash(filepath):
+def sampling_hash(filepath, sampler=None):
     fsize = checked_getsize(filepath)
     h = blake2b(digest_size=CK_BALANCE[0])
     if fsize > 0:
-        _do_sampling(h, filepath, fsize)
+        _do_sampling(h, filepath, fsize, sampler)
 
     concat_hash = int.from_bytes(
         fsize.to_bytes(CK_BALANCE[1]) + h.digest()
@@ -67,9 +133,61 @@ def sampling_hash(filepath):
     padding = 2 * sum(CK_BALANCE)
     return "{0:0{1}x}".format(concat_hash, padding)
 
+def checked_sampling_hash(filepath):
+    try:
+        return (filepath, sampling_hash(filepath), None)
+    except (OSError, OverflowError) as ex:
+        return (filepath, None, ex)
+
+def _resolved(value):
+    fut = Future()
+    fut.set_result(value)
+    return fut
+
+def _run_now(fn, *args):
+    return _resolved(fn(*args))
+
+def batch_hash(filepaths, workers=1, cache=None):
+    # Yields (filepath, digest, error) tuples in the same order as the
+    # filepaths were passed, so output matches that of hashing serially.
+    # When given a digest cache, files with an unchanged stat signature are
+    # never read.
+    def jobs(submit):
+        for fp in filepaths:
+            key, digest = cache.lookup(fp) if cache else (None, None)
+            if digest:
+                yield (key, _resolved( (fp, digest, None) ))
+            else:
+                yield (key, submit(checked_sampling_hash, fp))
+
+    def finish(key, fut):
+        result = fut.result()
+        if key and result[1]:
+            cache.store(key, result[1])
+        return result
+
+    if workers <= 1:
+        for job in jobs(_run_now):
+            yield finish(*job)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Keep a bounded window of files in flight, this way we start yielding
+        # results early and don't exhaust (possibly lazy) input up front.
+        pending = deque()
+        for job in jobs(pool.submit):
+            pending.append(job)
+            if len(pending) >= 2 * workers:
+                yield finish(*pending.popleft())
+        while pending:
+            yield finish(*pending.popleft())
+
 def history_grip(indices, datetimes):
     h = blake2b(digest_size=HIST_HANDLE_SIZE)
     for date in datetimes:
+        # Always over the text form, no matter how timestamps are stored.
+        if isinstance(date, int):
+            date = mnemedt.fromint(date)
         h.update( bytes(str(date), "ascii") )
     for i in indices:
         byte_length = math.ceil(i.bit_length() / 8)
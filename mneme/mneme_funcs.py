@@ -1,33 +1,173 @@
 #!/usr/bin/env python
 
-import json
+import re, sys
+from itertools import groupby, islice
+from operator import attrgetter
+
+from mnemedt import mnemedt
 from mneme_common import CONFIG
 
+# Machine-readable output formats, see `print_rows`.
+OUTPUT_FORMATS = ("jsonl", "tsv", "nul")
+
+# Characters we escape in output, so every record stays on a single line and
+# fields can be tab separated.
+ESCAPES = str.maketrans({
+    "\t": r"\t",
+    "\n": r"\n",
+    "\r": r"\r",
+    "\\": r"\\",
+})
+_NEEDS_ESCAPE = re.compile(r"[\t\n\r\\]")
+
+
+class chunked_writer:
+    # Collects output and writes it out in chunks, instead of a write per line.
+    def __init__(self, stream=None, chunk_size=256):
+        self.stream = stream or sys.stdout
+        self.chunk_size = chunk_size
+        self.chunk = []
+
+    def write(self, s):
+        self.chunk.append(s)
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.stream.write("".join(self.chunk))
+        self.stream.flush()
+        self.chunk.clear()
+
+def chunks(iterable, size):
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+def parse_opts(args, flags=(), options=()):
+    # Splits off known flags and options (which take a value, either as
+    # `--opt=value` or `--opt value`) from the rest of the arguments.
+    opts = {}
+    rest = []
+    it = iter(args)
+    for arg in it:
+        name, eq, value = arg.partition("=")
+        if arg in flags:
+            opts[arg] = True
+        elif name in options:
+            opts[name] = value if eq else next(it, None)
+        elif arg == "--":
+            rest.extend(it)
+        else:
+            rest.append(arg)
+    return (opts, rest)
+
+def get_int(value, default):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return default
+
+def get_format(opts):
+    fmt = opts.get("--format")
+    if fmt and not fmt in OUTPUT_FORMATS:
+        sys.exit("Unknown output format '{}', choose from: {}."
+                 .format(fmt, ", ".join(OUTPUT_FORMATS)))
+    return fmt
+
+def fmt_value(value):
+    if value is None:
+        return ""
+    elif isinstance(value, list):
+        import json
+        return json.dumps(value, ensure_ascii=False)
+    else:
+        return str(value)
+
+def column_names(cur):
+    return [col[0] for col in cur.description]
+
+def print_rows(names, rows, fmt, localtime=False):
+    # Streams rows as JSON Lines, TSV (with escaping) or NUL terminated fields
+    # (without escaping). With the latter, a header of the column names comes
+    # first, ended by an empty field, so readers know how many fields make up
+    # a row. Datetime columns are printed in UTC, unless local time is asked
+    # for.
+    import json
+
+    dt_idx = [i for i, name in enumerate(names) if name.endswith("_dt")]
+
+    out = chunked_writer()
+    if fmt == "tsv":
+        out.write("\t".join(names) + "\n")
+    elif fmt == "nul":
+        out.write("".join(name + "\0" for name in names) + "\0")
+    for row in rows:
+        if localtime and dt_idx:
+            row = list(row)
+            for i in dt_idx:
+                if row[i] is not None:
+                    row[i] = fmt_local(mnemedt.fromdb(row[i]))
+        elif any(isinstance(row[i], int) for i in dt_idx):
+            # Integer timestamps are printed as text all the same.
+            row = list(row)
+            for i in dt_idx:
+                if row[i] is not None:
+                    row[i] = str(mnemedt.fromdb(row[i]))
+
+        match fmt:
+            case "jsonl":
+                out.write(
+                    json.dumps(dict(zip(names, row)), ensure_ascii=False)
+                    + "\n"
+                )
+            case "tsv":
+                out.write(
+                    "\t".join(replace_ws(fmt_value(v)) for v in row) + "\n"
+                )
+            case "nul":
+                out.write("".join(fmt_value(v) + "\0" for v in row))
+    out.flush()
+
+def first_fields(lines):
+    for line in lines:
+        fields = line.split(maxsplit=1)
+        if fields:
+            yield fields[0]
+
+def read_args(args, from_file=None):
+    # Besides the arguments themselves, reads the first field of each line from
+    # stdin (when passed `-`) and/or a file, so that output of other commands
+    # can be piped in.
+    for arg in args:
+        if arg == "-":
+            yield from first_fields(sys.stdin)
+        else:
+            yield arg
+    if from_file:
+        with open(from_file) as f:
+            yield from first_fields(f)
 
 def fmt_local(timestamp):
     return timestamp.localdt().strftime(CONFIG.datetime_display_format)
 
+def group_filenames(results):
+    # Groups file_name rows, ordered by file, into (hash, filenames).
+    for file_hash, rows in groupby(results, key=attrgetter("hash")):
+        yield (file_hash, [row.name for row in rows])
+
 def print_filehashes(results):
+    out = chunked_writer()
     for row in results:
-        filenames = json.loads(row[1])
-        print("{}\t{}".format(row[0], filenames))
+        out.write("{}\t{}\n".format(row[0], row[1]))
+    out.flush()
+
+def print_hash_error(filepath, err):
+    print("Unable to hash {}: {}".format(replace_ws(filepath), err),
+          file=sys.stderr)
 
 def replace_ws(s):
-    val = [c for c in s]
-    for i in range(len(val)):
-        match ord(val[i]):
-            # Horizontal Tab.
-            case 0x9:
-                val[i] = r'\t'
-            # Line Feed.
-            case 0xA:
-                val[i] = r'\n'
-            # Carriage Return.
-            case 0xD:
-                val[i] = r'\r'
-
-            # Backslash (\).
-            case 0x5C:
-                val[i] = r'\\'
-
-    return ''.join(val)
+    # Most strings contain nothing to escape, skip building a new one.
+    if _NEEDS_ESCAPE.search(s):
+        return s.translate(ESCAPES)
+    else:
+        return s
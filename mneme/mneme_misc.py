@@ -1,36 +1,215 @@
 #!/usr/bin/env python
 
-import sys
+import os, sys, time
+from os import path
+
 from mnemedt import mnemedt
-from mneme_common import initialize_sqlite
-from mneme_digests import history_grip
-from mneme_wrapper import get_file_id, update_filetrack, yield_files
+from mneme_cache import open_digest_cache
+from mneme_common import (
+    CONFIG, initialize_sqlite, retry_busy, to_db, write_transaction
+)
+from mneme_digests import batch_hash, history_grip
+from mneme_funcs import (
+    chunks, get_int, parse_opts, print_hash_error, replace_ws
+)
+from mneme_sql import (
+    CLOSED_EVENTS, DELETE_META, GET_META, GRIP_COLLISIONS, KNOWN_SIGNATURES,
+    MAX_HISTORY_ID, SET_GRIP, SET_META, TOUCH_FILETRACK, closed_event,
+    signature, typed
+)
+from mneme_wrapper import hash_files, ingest_files
+
+
+##### SCANNING #####
+
+def scan_tree(root):
+    # Walks a directory tree depth-first, yielding (filepath, stat) for every
+    # regular file. Symlinked directories aren't followed, to avoid loops.
+    dirs = [root]
+    while dirs:
+        try:
+            entries = os.scandir(dirs.pop())
+        except OSError as ex:
+            print("Unable to scan {}".format(ex), file=sys.stderr)
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file():
+                        yield (entry.path, entry.stat())
+                except OSError as ex:
+                    print("Unable to stat {}".format(ex), file=sys.stderr)
+
+def yield_entries(args):
+    for arg in args:
+        arg = path.expanduser(arg)
+        if path.isdir(arg):
+            yield from scan_tree(arg)
+        elif path.isfile(arg):
+            yield (arg, os.stat(arg))
+
+def known_signatures(conn, filepaths):
+    # Last known signature of the filepaths, by filepath.
+    import json
+    results = typed(conn.cursor(), signature).execute(
+        KNOWN_SIGNATURES, (json.dumps(filepaths),)
+    )
+    return { row.filepath: row for row in results }
+
+def add_batch(cur, hashed, signatures, unchanged, timestamp):
+    import json
+    ingest_files(cur, hashed, timestamp, signatures)
+    cur.execute(TOUCH_FILETRACK, (to_db(timestamp), json.dumps(unchanged)))
+
+def print_progress(label, scanned, changed, secs):
+    print(
+        "{} {} file(s), {} new or changed, in {:.1f}s ({:.0f} files/s)."
+        .format(label, scanned, changed, secs, scanned / max(secs, 1e-6)),
+        file=sys.stderr
+    )
+
+
+##### GRIPS #####
+
+# Where in history `mneme calc-grips` got to, stored in the meta table.
+GRIPS_CHECKPOINT = "calc_grips_id"
+
+def event_grip(row):
+    # Grip of a closed_event row, same as `stop_grip` computes it.
+    return history_grip(row[:3], row[3:5])
+
+def write_grips(cur, updates, last_id):
+    # Sets the chunk's grips, moving the checkpoint past it in the same
+    # transaction, so we resume exactly where we left off.
+    cur.executemany(SET_GRIP, updates)
+    cur.execute(SET_META, (GRIPS_CHECKPOINT, last_id))
+
+def calc_grips(conn, chunk_size, pool=None):
+    # Recomputes grips of closed events in chunks of chunk_size, in history ID
+    # order, starting after the checkpoint. Yields (last ID, rows, updates) for
+    # every chunk written, and clears the checkpoint once through.
+    row = conn.execute(GET_META, (GRIPS_CHECKPOINT,)).fetchone()
+    last_id = row[0] if row else 0
+    cur = typed(conn.cursor(), closed_event)
+    while rows := cur.execute(CLOSED_EVENTS, (last_id, chunk_size)).fetchall():
+        if pool:
+            grips = pool.map(event_grip, rows, chunksize=256)
+        else:
+            grips = map(event_grip, rows)
+        updates = [(grip, row.id) for row, grip in zip(rows, grips)
+                   if grip != row.grip]
+        last_id = rows[-1].id
+        retry_busy(write_transaction, conn, write_grips, updates, last_id)
+        yield (last_id, len(rows), updates)
+    conn.execute(DELETE_META, (GRIPS_CHECKPOINT,))
+    conn.commit()
+
+def grip_collisions(conn, grips):
+    import json
+    return conn.execute(
+        GRIP_COLLISIONS, (json.dumps(sorted(grips)),)
+    ).fetchall()
 
 
+##### ENTRYPOINTS #####
+
+# mneme <add> [--batch=N] <file|directory...>
 def run_add():
-    conn = initialize_sqlite()
-    cur = conn.cursor()
+    opts, args = parse_opts(sys.argv[1:], options=("--batch",))
+    batch_size = max(get_int(opts.get("--batch"), 500), 1)
 
+    conn = initialize_sqlite()
+    cache = open_digest_cache()
     timestamp = mnemedt.now()
-    count = 0
-    for filepath in yield_files():
-        file_id = get_file_id(cur, filepath)
-        update_filetrack(cur, file_id, filepath, timestamp)
-        count += 1
-    conn.commit()
+    start = time.perf_counter()
+    scanned = 0
+    changed = 0
+    for batch in chunks(yield_entries(args), batch_size):
+        # Only (re)hash files we don't know about, or whose size or
+        # modification time changed since we last saw them.
+        known = known_signatures(
+            conn, [path.abspath(fpath) for fpath, _ in batch]
+        )
+        signatures = {}
+        unchanged = []
+        for fpath, st in batch:
+            sig = (st.st_size, st.st_mtime_ns)
+            prev = known.get(path.abspath(fpath))
+            if prev and (prev.st_size, prev.st_mtime_ns) == sig:
+                unchanged.append(prev.id)
+            else:
+                signatures[fpath] = sig
+
+        hashed = hash_files(signatures, cache)
+        retry_busy(
+            write_transaction, conn, add_batch, hashed, signatures, unchanged,
+            timestamp
+        )
+        scanned += len(batch)
+        changed += len(hashed)
+        print_progress("Scanned", scanned, changed,
+                       time.perf_counter() - start)
+
+    if cache:
+        cache.close()
+    print_progress("Processed", scanned, changed, time.perf_counter() - start)
 
-    print("Processed {} file(s).".format(count), file=sys.stderr)
+def run_hash():
+    files = filter(path.isfile, sys.argv[1:])
+    cache = open_digest_cache()
+    for f, file_hash, err in batch_hash(files, CONFIG.hash_workers, cache):
+        if err:
+            print_hash_error(f, err)
+        else:
+            print("{}  {}".format(file_hash, replace_ws(f)))
+    if cache:
+        cache.close()
 
+# mneme <calc-grips> [--chunk=N] [--workers=N] [--restart]
 def run_calc_grips():
+    opts, args = parse_opts(
+        sys.argv[1:], flags=("--restart",), options=("--chunk", "--workers")
+    )
+    chunk_size = max(get_int(opts.get("--chunk"), 5000), 1)
+    workers = get_int(opts.get("--workers"), 1)
+
     conn = initialize_sqlite()
+    if "--restart" in opts:
+        conn.execute(DELETE_META, (GRIPS_CHECKPOINT,))
+        conn.commit()
+    max_id = conn.execute(MAX_HISTORY_ID).fetchone()[0]
+    pool = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=workers)
 
-    results = conn.execute(
-        """SELECT id, file_id, ftrack_id, start_dt, stop_dt FROM history
-        WHERE stop_dt IS NOT NULL"""
-    )
-    for row in results:
-        grip = history_grip(row[:3], row[3:])
-        conn.execute(
-            "UPDATE history SET grip=? WHERE id=?", (grip, row[0])
-        )
-    conn.commit()
+    start = time.perf_counter()
+    events = 0
+    changed = 0
+    grips = set()
+    try:
+        for last_id, count, updates in calc_grips(conn, chunk_size, pool):
+            events += count
+            changed += len(updates)
+            grips.update(grip for grip, hist_id in updates)
+            print(
+                "Checked grips of {} event(s) up to ID {} of {}, {} changed, "
+                "in {:.1f}s.".format(events, last_id, max_id, changed,
+                                     time.perf_counter() - start),
+                file=sys.stderr
+            )
+    finally:
+        if pool:
+            pool.shutdown()
+
+    print("Recomputed grips of {} event(s), {} changed."
+          .format(events, changed), file=sys.stderr)
+    collisions = grip_collisions(conn, grips)
+    for grip, grip_count in collisions:
+        print("Grip {} is now shared by {} events.".format(grip, grip_count),
+              file=sys.stderr)
+    if collisions:
+        print("Tell these apart with a grip-spec, as latest and search show.",
+              file=sys.stderr)
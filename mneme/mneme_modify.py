@@ -1,22 +1,56 @@
 #!/usr/bin/env python
 
-import re, sys
+import json, re, sys
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from operator import attrgetter
+
 from mnemedt import mnemedt
-from mneme_common import initialize_sqlite
-from mneme_funcs import fmt_local, print_filehashes, replace_ws
+from mneme_common import (
+    TIMESTAMP_MODES, convert_timestamps, initialize_sqlite, retry_busy, to_db,
+    write_transaction
+)
+from mneme_funcs import (
+    chunked_writer, fmt_local, get_int, group_filenames, parse_opts,
+    print_filehashes, read_args, replace_ws
+)
+from mneme_sql import (
+    CLEAR_GRIP_SPECS, CLEAR_PURGE_HASHES, COUNT_UNREFERENCED,
+    CREATE_GRIP_SPECS, CREATE_PURGE_HASHES, DELETE_EVENTS, DELETE_PURGED_FILES,
+    DELETE_UNREFERENCED, FILL_GRIP_SPECS, FILL_PURGE_HASHES, PURGE_HASHES_COND,
+    RESOLVE_GRIP_SPECS, UNREFERENCED, file_name, file_names_sql, grip_match,
+    typed
+)
 
 
-def parse_purge_args():
-    args = []
-    for arg in sys.argv[1:]:
+def parse_purge_args(args):
+    hashes = []
+    for arg in args:
         m = re.fullmatch('[0-9a-f]{21,32}', arg)
         if m:
-            args.append(m.string.zfill(32))
-    return args
+            hashes.append(m.string.zfill(32))
+    return hashes
+
+def date_range(parts):
+    # UTC datetime range covered by a grip-spec's year[, month[, day]]. Without
+    # any, that's all of time, so lookups always range over (grip, start_dt).
+    if not parts:
+        return ( to_db(mnemedt(datetime.min.replace(tzinfo=timezone.utc))),
+                 to_db(mnemedt(datetime.max.replace(tzinfo=timezone.utc))) )
+    year, month, day = parts + [1] * (3 - len(parts))
+    start = datetime(year, month, day, tzinfo=timezone.utc)
+    match len(parts):
+        case 1:
+            end = start.replace(year=year + 1)
+        case 2:
+            end = start.replace(year=year + month // 12, month=month % 12 + 1)
+        case _:
+            end = start + timedelta(days=1)
+    return ( to_db(mnemedt(start)), to_db(mnemedt(end)) )
 
-def parse_del_args():
-    args = []
-    for arg in sys.argv[1:]:
+def parse_del_args(args):
+    specs = []
+    for arg in args:
         m = re.fullmatch(
             '(?P<Y>[0-9]{4})?\.?' +
             '(?P<M>[0-9]{2})?\.?' +
@@ -25,101 +59,149 @@ def parse_del_args():
             arg
         )
         if m:
-            date_q = ""
+            parts = []
             for c in ('Y', 'M', 'D'):
                 if m[c]:
-                    date_q = date_q + m[c] + '-'
+                    parts.append(int(m[c]))
                 else:
                     break
-            date_q = date_q.removesuffix('-') + '%'
-            args.append( (m["grip"], date_q) )
-    return args
-
-def cleanup(cur):
-    ftrack_count = cur.execute(
-        """SELECT count(id) FROM filetrack WHERE id NOT IN
-        (SELECT ftrack_id FROM history)"""
-    ).fetchone()
-    file_count = cur.execute(
-        """SELECT count(id) FROM files WHERE id NOT IN
-        (SELECT file_id FROM history)"""
-    ).fetchone()
-
-    cur.executescript(
-        """DELETE FROM filetrack WHERE id NOT IN
-        (SELECT ftrack_id FROM history);
-
-        DELETE FROM files WHERE id NOT IN
-        (SELECT file_id FROM history);"""
+            try:
+                specs.append( (arg, m["grip"]) + date_range(parts) )
+            except ValueError:
+                # Not a valid date, so it can't match anything either.
+                pass
+    return specs
+
+def count_unreferenced(cur):
+    return tuple(
+        cur.execute(COUNT_UNREFERENCED.format(select)).fetchone()[0]
+        for _, select in UNREFERENCED
     )
-    return (ftrack_count[0], file_count[0])
-
-def del_history(cur, grip_spec):
-    result = cur.execute(
-        """SELECT COUNT(grip), start_dt, filepath FROM history
-        JOIN filetrack ON filetrack.id = history.ftrack_id
-        WHERE grip=? AND start_dt LIKE ?""",
-        grip_spec
-    ).fetchone()
-
-    if result[0] > 1:
-        print("Grip {} has multiple matches, ".format(grip_spec[0]) +
-              "please use a more specific grip-spec.", file=sys.stderr)
-    elif result[0] == 1:
-        ts = fmt_local(mnemedt.fromstr(result[1]))
-        fp = replace_ws(result[2])
-        print("{}\t{}\t{}".format(grip_spec[0], ts, fp))
+
+def cleanup(cur, limit=-1):
+    # Filepaths go first, files with no history can't have any filepaths
+    # referenced from history either.
+    return tuple(
         cur.execute(
-            """DELETE FROM history
-            WHERE grip=? AND start_dt LIKE ?""",
-            grip_spec
-        )
+            DELETE_UNREFERENCED.format(table, select),
+            (limit,)
+        ).rowcount
+        for table, select in UNREFERENCED
+    )
+
+def cleanup_chunk(conn, limit):
+    return write_transaction(conn, cleanup, limit)
+
+def resolve_grip_specs(cur, specs):
+    # Resolves all grip-specs in one go, returning the matching history events
+    # per grip-spec. The same grip-spec passed twice (common when piped in) is
+    # resolved once, or its matches would look ambiguous.
+    cur.execute(CREATE_GRIP_SPECS)
+    cur.execute(CLEAR_GRIP_SPECS)
+    cur.executemany(FILL_GRIP_SPECS, dict.fromkeys(specs))
+    results = typed(cur.connection.cursor(), grip_match).execute(
+        RESOLVE_GRIP_SPECS
+    )
+    return groupby(results, key=attrgetter("spec"))
+
+def del_history(cur, specs):
+    ambiguous = []
+    to_delete = {}
+    for spec, matches in resolve_grip_specs(cur, specs):
+        matches = list(matches)
+        if len(matches) > 1:
+            ambiguous.append(spec)
+        else:
+            to_delete[matches[0].id] = matches[0]
+
+    out = chunked_writer()
+    for match in to_delete.values():
+        ts = fmt_local(mnemedt.fromdb(match.start_dt))
+        out.write("{}\t{}\t{}\n"
+                  .format(match.grip, ts, replace_ws(match.filepath)))
+    out.flush()
+    cur.execute(DELETE_EVENTS, (json.dumps(list(to_delete)),))
+
+    if ambiguous:
+        print("Multiple matches for grip-spec(s) {}, ".format(
+              ", ".join(ambiguous)) +
+              "please use a more specific grip-spec.", file=sys.stderr)
 
 def del_yield_filehashes(cur, hashes_to_remove):
-    for hash in hashes_to_remove:
-        result = cur.execute(
-            """DELETE FROM files WHERE hash=?
-            RETURNING hash, filenames""",
-            (hash,)
-        ).fetchone()
-        if result:
-            yield result
+    cur.execute(CREATE_PURGE_HASHES)
+    cur.execute(CLEAR_PURGE_HASHES)
+    cur.executemany(FILL_PURGE_HASHES, ( (h,) for h in hashes_to_remove ))
+    purged = list(group_filenames(
+        typed(cur.connection.cursor(), file_name)
+        .execute(file_names_sql(PURGE_HASHES_COND))
+    ))
+    cur.execute(DELETE_PURGED_FILES)
+    return purged
 
 
 ##### ENTRYPOINTS #####
 
-# mneme <cleanup>
+# mneme <cleanup> [--dry-run] [--chunk=N]
 def run_cleanup():
+    opts, args = parse_opts(
+        sys.argv[1:], flags=("--dry-run",), options=("--chunk",)
+    )
+    if "--dry-run" in opts:
+        conn = initialize_sqlite(readonly=True)
+        counts = count_unreferenced(conn.cursor())
+        print("Would remove {} filepaths and {} files, ".format(*counts) +
+              "since no history records reference them.", file=sys.stderr)
+        return
+
     conn = initialize_sqlite()
-    cur = conn.cursor()
-    # We manually start our (write) transaction here, because we start off with
-    # SELECT queries, and we want to make sure the DB hasn't changed between
-    # the SELECT queries and successive DELETE statements.
-    cur.execute("BEGIN IMMEDIATE")
-    counts = cleanup(cur)
-    conn.commit()
-    print("Removed {} filepaths and {} files, ".format(counts[0], counts[1]) +
+    # In chunked mode we delete at most N rows of each per transaction,
+    # releasing the write lock in between so others (the wrapper) get a turn.
+    chunk = get_int(opts.get("--chunk"), -1)
+    counts = (0, 0)
+    while True:
+        deleted = retry_busy(cleanup_chunk, conn, chunk)
+        counts = (counts[0] + deleted[0], counts[1] + deleted[1])
+        if chunk <= 0 or max(deleted) < chunk:
+            break
+    print("Removed {} filepaths and {} files, ".format(*counts) +
           "since no history records reference them.", file=sys.stderr)
 
-# mneme <del> <grip-spec...>
+# mneme <migrate> --timestamps=<text|int>
+def run_migrate():
+    opts, args = parse_opts(sys.argv[1:], options=("--timestamps",))
+    mode = opts.get("--timestamps")
+    if not mode in TIMESTAMP_MODES:
+        sys.exit("Pass --timestamps with one of: {}."
+                 .format(", ".join(TIMESTAMP_MODES)))
+
+    conn = initialize_sqlite()
+    if retry_busy(convert_timestamps, conn, mode):
+        conn.execute("VACUUM")
+        print("Timestamps are now stored as {}.".format(mode),
+              file=sys.stderr)
+    else:
+        print("Timestamps are already stored as {}.".format(mode),
+              file=sys.stderr)
+
+# mneme <del> [--from=FILE] <grip-spec...|->
 def run_delete():
+    opts, args = parse_opts(sys.argv[1:], options=("--from",))
+
+    # Connect first, date ranges depend on how the DB stores timestamps.
     conn = initialize_sqlite()
-    cur = conn.cursor()
-    # We manually start our (write) transaction here, because we start off with
-    # a SELECT query, and we want to make absolutely sure the DB hasn't changed
-    # between the SELECT and subsequent DELETE statement.
-    cur.execute("BEGIN IMMEDIATE")
+    specs = parse_del_args(read_args(args, opts.get("--from")))
+    # Resolving the specs and deleting what they match happen in the same
+    # write transaction, so the DB can't change in between.
     print("Deleting media events from history:\n", file=sys.stderr)
-    for gpair in parse_del_args():
-        del_history(cur, gpair)
-    conn.commit()
+    write_transaction(conn, del_history, specs)
 
-# mneme <purge> <hash...>
+# mneme <purge> [--from=FILE] <hash...|->
 def run_purge():
+    opts, args = parse_opts(sys.argv[1:], options=("--from",))
+    hashes = parse_purge_args(read_args(args, opts.get("--from")))
+
     conn = initialize_sqlite()
-    cur = conn.cursor()
     print("Purging from all history records:\n", file=sys.stderr)
-    print_filehashes(
-        del_yield_filehashes(cur, parse_purge_args())
+    write_transaction(
+        conn, lambda cur: print_filehashes(del_yield_filehashes(cur, hashes))
     )
-    conn.commit()
@@ -1,53 +1,90 @@
 #!/usr/bin/env python
 
-import sys
+import re, sys
 from datetime import timedelta
 from os import path
 
 from mnemedt import mnemedt
-from mneme_common import CONFIG, initialize_sqlite
-from mneme_funcs import fmt_local, print_filehashes, replace_ws
+from mneme_common import CONFIG, initialize_sqlite, to_db
+from mneme_funcs import (
+    chunked_writer, column_names, fmt_local, get_format, get_int,
+    group_filenames, parse_opts, print_filehashes, print_rows, replace_ws
+)
+from mneme_sql import (
+    COUNTS, EVENTS_FTS_COND, EVENTS_LIKE_COND, FILES_LIKE, FILES_MATCHING,
+    NOW_PLAYING, db_counts, event, events_sql, file_name, file_names_sql,
+    playing, seen_file, typed
+)
+
+# Options shared by all commands with machine-readable output.
+FORMAT_FLAGS = ("--localtime",)
+FORMAT_OPTIONS = ("--format",)
 
 
 ##### HELPER FUNCTIONS #####
 
-def get_arg(idx):
-    if idx < len(sys.argv):
-        return sys.argv[idx]
+def get_query(args):
+    # Returns a full-text search query for the arguments, or a LIKE pattern if
+    # `--like` was passed (for exact substring matching) or no argument has
+    # anything to match on.
+    opts, args = parse_opts(args, flags=("--like",))
+    terms = [arg for arg in args if re.search(r"\w", arg)]
+    if terms and not opts:
+        # Each argument is matched as a phrase, its last token as prefix.
+        fts_query = " ".join(
+            '"{}"*'.format(term.replace('"', '""')) for term in terms
+        )
+        return (fts_query, None)
     else:
-        return None
+        return (None, "%" + " ".join(args) + "%")
 
-def fmt_grip_spec(dt, grip, grip_count):
-    if grip_count > 1:
-        return dt.strftime("%Y.%m.%d.{}".format(grip))
+def get_keyset(opts, name, op):
+    # Keyset pagination on start_dt, with the history ID to break ties between
+    # events started together. Returns the SQL conditions and their values.
+    if opts.get(name):
+        dt_str, _, hist_id = opts[name].partition(",")
+        try:
+            start = to_db(mnemedt.parse(dt_str))
+            hist_id = int(hist_id) if hist_id else None
+        except (ValueError, OverflowError):
+            sys.exit("Invalid {} '{}', expected a datetime (ISO 8601), "
+                     "optionally followed by ,ID.".format(name, opts[name]))
+        if hist_id is not None:
+            cond = "(start_dt, h.id) {} (?, ?)".format(op)
+            return ( [cond], [start, hist_id] )
+        else:
+            return ( ["start_dt {} ?".format(op)], [start] )
     else:
-        return grip
-
-def print_entry(row):
-    file_loc, filename = tuple( map(replace_ws, path.split(row[0])) )
-    # First use UTC timestamp to construct grip-spec.
-    start = mnemedt.fromstr(row[1])
-    grip_spec = fmt_grip_spec(start, row[4], row[5])
-    # But convert to local datetime for displaying.
-    start = fmt_local(start)
-    if row[2]:
-        stop = fmt_local(mnemedt.fromstr(row[2]))
-        play_time = timedelta(seconds=row[3])
-        print(
-            "{}: [{}]\n@ {}\n[{}] {} ---> {}\n"
-            .format(filename, play_time, file_loc, grip_spec, start, stop)
+        return ([], [])
+
+def fmt_entry(row):
+    file_loc, filename = path.split(row.filepath)
+    grip_spec = row.grip_spec
+    start = fmt_local(mnemedt.fromdb(row.start_dt))
+    if row.stop_dt:
+        stop = fmt_local(mnemedt.fromdb(row.stop_dt))
+        play_time = timedelta(seconds=row.play_secs)
+        return (
+            "{}: [{}]\n@ {}\n[{}] {} ---> {}\n\n"
+            .format(replace_ws(filename), play_time, replace_ws(file_loc),
+                    grip_spec, start, stop)
         )
     else:
-        print(
-            "{}: [NOW PLAYING]\n@ {}\n[{}] {} ---> ?\n"
-            .format(filename, file_loc, grip_spec, start)
+        return (
+            "{}: [NOW PLAYING]\n@ {}\n[{}] {} ---> ?\n\n"
+            .format(replace_ws(filename), replace_ws(file_loc),
+                    grip_spec, start)
         )
 
 def print_results(results, footer = False):
+    out = chunked_writer()
     count = 0
+    last = None
     for row in results:
         count += 1
-        print_entry(row)
+        last = row
+        out.write(fmt_entry(row))
+    out.flush()
     print("-" * 72, file=sys.stderr)
     if footer:
         if count == 1:
@@ -56,10 +93,18 @@ def print_results(results, footer = False):
             s = "s"
         print("Found {} event{} in media history."
               .format(count, s), file=sys.stderr)
+    return (count, last)
+
+def print_next_page(option, count, limit, last):
+    # Hint at how to get the next page, if there could be one.
+    if limit > 0 and count >= limit:
+        print("Next page: {}={},{}"
+              .format(option, mnemedt.fromdb(last.start_dt), last.id),
+              file=sys.stderr)
 
 def print_np(result):
-    filename = path.basename(result[0])
-    start_utc = mnemedt.fromstr(result[1])
+    filename = path.basename(result.filepath)
+    start_utc = mnemedt.fromdb(result.start_dt)
     now_utc = mnemedt.now()
     # Calcute interim playing time and chop off microseconds.
     play_time = str(now_utc - start_utc)[:7]
@@ -67,109 +112,145 @@ def print_np(result):
         "{}: [{}]".format(replace_ws(filename), play_time)
     )
 
+def now_playing(conn):
+    return typed(conn.cursor(), playing).execute(NOW_PLAYING).fetchone()
+
 def print_files(results):
+    out = chunked_writer()
     for row in results:
-        last_seen = mnemedt.fromstr(row[1])
-        print(
-            "{}\nLast seen: {}\n"
-              .format(row[0], fmt_local(last_seen))
+        last_seen = mnemedt.fromdb(row.last_seen_dt)
+        out.write(
+            "{}\nLast seen: {}\n\n"
+              .format(row.filepath, fmt_local(last_seen))
         )
+    out.flush()
     print("-" * 72, file=sys.stderr)
 
 
 ##### ENTRYPOINTS #####
 
-# mneme <fs> [query]
+# mneme <fs> [--like] [--format=FMT [--localtime]] [query]
 def run_filesearch():
-    if len(sys.argv) > 1:
-        query = "%" + " ".join(sys.argv[1:]) + "%"
-    else:
-        query = "%"
+    opts, args = parse_opts(
+        sys.argv[1:], flags=FORMAT_FLAGS, options=FORMAT_OPTIONS
+    )
+    fmt = get_format(opts)
+    fts_query, like_query = get_query(args)
 
-    conn = initialize_sqlite()
-    results = conn.execute(
-        """SELECT filepath, last_seen_dt FROM filetrack
-        WHERE filepath LIKE ?""",
-        (query,)
+    conn = initialize_sqlite(readonly=True)
+    results = typed(conn.cursor(), seen_file).execute(
+        FILES_MATCHING if fts_query else FILES_LIKE,
+        (fts_query or like_query,)
     )
-    print_files(results)
+    if fmt:
+        print_rows(
+            column_names(results), results, fmt, "--localtime" in opts
+        )
+    else:
+        print_files(results)
 
-# mneme <latest|l> [count]
+# mneme <latest|l> [--limit=N] [--offset=N] [--before=DATETIME]
+#                  [--format=FMT [--localtime]] [count]
 def run_latest():
-    try:
-        limit = int(get_arg(1))
-    except (ValueError, TypeError):
-        limit = CONFIG.latest_default_limit
-
-    conn = initialize_sqlite()
-    results = conn.execute(
-        """SELECT
-        filepath, start_dt, stop_dt, play_secs, h.grip, grip_count
-        FROM history AS h
-        JOIN filetrack ON filetrack.id = h.ftrack_id
-        JOIN v_grips ON v_grips.grip = h.grip
-        ORDER BY start_dt DESC LIMIT ?""",
-        (limit,)
-    ).fetchall()
+    opts, args = parse_opts(
+        sys.argv[1:], flags=FORMAT_FLAGS,
+        options=FORMAT_OPTIONS + ("--limit", "--offset", "--before")
+    )
+    fmt = get_format(opts)
+    limit = get_int(
+        opts.get("--limit", args[0] if args else None),
+        CONFIG.latest_default_limit
+    )
+    offset = get_int(opts.get("--offset"), 0)
+
+    # Connect first, keyset values depend on how the DB stores timestamps.
+    conn = initialize_sqlite(readonly=True)
+    conds, params = get_keyset(opts, "--before", "<")
+    cur = typed(conn.cursor(), event).execute(
+        events_sql(conds, descending=True), params + [limit, offset]
+    )
+    results = cur.fetchall()
+    if fmt:
+        print_rows(
+            column_names(cur), reversed(results), fmt, "--localtime" in opts
+        )
+        return
     print_results(reversed(results))
+    if results:
+        print_next_page("--before", len(results), limit, results[-1])
 
-# mneme <list-hashes|lh>
+# mneme <list-hashes|lh> [--format=FMT]
 def run_list_hashes():
-    conn = initialize_sqlite()
-    results = conn.execute(
-        "SELECT hash, filenames FROM files"
+    opts, args = parse_opts(sys.argv[1:], options=FORMAT_OPTIONS)
+    fmt = get_format(opts)
+
+    conn = initialize_sqlite(readonly=True)
+    results = group_filenames(
+        typed(conn.cursor(), file_name).execute(file_names_sql())
     )
-    print_filehashes(results)
+    if fmt:
+        print_rows(("hash", "filenames"), results, fmt)
+    else:
+        print_filehashes(results)
 
 # mneme <playing|np>
 def run_playing():
-    conn = initialize_sqlite()
-    result = conn.execute(
-        """SELECT filepath, start_dt FROM history
-        JOIN filetrack on filetrack.id = history.ftrack_id
-        WHERE stop_dt IS NULL
-        ORDER BY start_dt DESC LIMIT 1"""
-    ).fetchone()
+    result = now_playing(initialize_sqlite(readonly=True))
     if result:
         print_np(result)
 
-# mneme <search|s> [query]
+# mneme <search|s> [--like] [--limit=N] [--offset=N] [--after=DATETIME]
+#                  [--format=FMT [--localtime]] [query]
 def run_search():
-    if len(sys.argv) > 1:
-        query = "%" + " ".join(sys.argv[1:]) + "%"
-    else:
-        query = "%"
-
-    conn = initialize_sqlite()
-    results = conn.execute(
-        """SELECT
-        filepath, start_dt, stop_dt, play_secs, h.grip, grip_count
-        FROM history AS h
-        JOIN filetrack ON filetrack.id = h.ftrack_id
-        JOIN v_grips ON v_grips.grip = h.grip
-        WHERE filepath LIKE ?
-        ORDER BY start_dt""",
-        (query,)
+    opts, args = parse_opts(
+        sys.argv[1:], flags=FORMAT_FLAGS,
+        options=FORMAT_OPTIONS + ("--limit", "--offset", "--after")
     )
-    print_results(results, True)
+    fmt = get_format(opts)
+    limit = get_int(opts.get("--limit"), -1)
+    offset = get_int(opts.get("--offset"), 0)
 
-# mneme <stats>
-def run_stats():
-    counts = []
-    selects = (
-        "SELECT count(id) FROM history",
-        "SELECT count(id) FROM files",
-        "SELECT count(id) FROM filetrack"
+    conn = initialize_sqlite(readonly=True)
+    conds, params = get_keyset(opts, "--after", ">")
+    fts_query, like_query = get_query(args)
+    conds.append(EVENTS_FTS_COND if fts_query else EVENTS_LIKE_COND)
+    params.append(fts_query or like_query)
+    results = typed(conn.cursor(), event).execute(
+        events_sql(conds), params + [limit, offset]
     )
+    if fmt:
+        print_rows(
+            column_names(results), results, fmt, "--localtime" in opts
+        )
+        return
+    count, last = print_results(results, True)
+    print_next_page("--after", count, limit, last)
+
+# mneme <stats> [--format=FMT]
+def run_stats():
+    opts, args = parse_opts(sys.argv[1:], options=FORMAT_OPTIONS)
+    fmt = get_format(opts)
 
-    conn = initialize_sqlite()
-    cur = conn.cursor()
-    for s in selects:
-        result = cur.execute(s).fetchone()
-        counts.append(result[0])
+    conn = initialize_sqlite(readonly=True)
+    cur = typed(conn.cursor(), db_counts).execute(COUNTS)
+    if fmt:
+        print_rows(column_names(cur), cur, fmt)
+        return
+    counts = cur.fetchone()
     print(
         "I have knowledge of {} files and {} filepaths.\n"
-        .format(counts[1], counts[2]) +
-        "There are {} media events recorded in history."
-        .format(counts[0])
+        .format(counts.files, counts.filepaths) +
+        "There are {} media events recorded in history, "
+        .format(counts.events) +
+        "with {} of play time."
+        .format(timedelta(seconds=counts.play_secs))
     )
+
+    from mneme_cache import cache_counters
+    counters = cache_counters()
+    if counters and sum(counters) > 0:
+        hits, misses = counters
+        print(
+            "Digest cache hit rate is {:.1%} ({} hits, {} misses)."
+            .format(hits / (hits + misses), hits, misses)
+        )
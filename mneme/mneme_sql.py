@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+# Size of each connection's prepared statement cache, comfortably more than
+# all statements below and the variants built from them. `mneme bench plans`
+# keeps us honest.
+STATEMENT_CACHE_SIZE = 96
+
+from collections import namedtuple
+
+
+##### ROW TYPES #####
+
+event = namedtuple(
+    "event",
+    "filepath start_dt stop_dt play_secs grip grip_count id grip_spec"
+)
+playing = namedtuple("playing", "filepath start_dt")
+seen_file = namedtuple("seen_file", "filepath last_seen_dt")
+file_name = namedtuple("file_name", "hash name")
+db_counts = namedtuple("db_counts", "events files filepaths play_secs")
+signature = namedtuple("signature", "filepath id st_size st_mtime_ns")
+grip_match = namedtuple("grip_match", "spec id grip start_dt filepath")
+closed_event = namedtuple(
+    "closed_event", "id file_id ftrack_id start_dt stop_dt grip"
+)
+period_plays = namedtuple("period_plays", "period events play_secs")
+top_file = namedtuple("top_file", "hash name events play_secs")
+renamed_file = namedtuple("renamed_file", "hash name renames")
+
+def typed(cur, row_type):
+    # Has the cursor return its rows as row_type.
+    cur.row_factory = lambda cursor, row: row_type(*row)
+    return cur
+
+
+##### QUERIES #####
+
+GET_META = "SELECT value FROM meta WHERE name = ?"
+
+SET_META = """INSERT INTO meta VALUES(?, ?)
+ON CONFLICT(name) DO UPDATE SET value = excluded.value"""
+
+DELETE_META = "DELETE FROM meta WHERE name = ?"
+
+DATA_VERSION = "PRAGMA data_version"
+
+NOW_PLAYING = """SELECT filepath, start_dt FROM history
+JOIN filetrack ON filetrack.id = history.ftrack_id
+WHERE stop_dt IS NULL
+ORDER BY start_dt DESC LIMIT 1"""
+
+# Matches on filepaths as well as any of the file's known names, best matches
+# first.
+FILES_MATCHING = """SELECT filepath, last_seen_dt FROM filetrack
+JOIN (
+  SELECT rowid AS id, rank FROM filetrack_fts
+  WHERE filetrack_fts MATCH ?1
+  UNION ALL
+  SELECT ft.id, filenames_fts.rank FROM filenames_fts
+  JOIN filenames AS fn ON fn.id = filenames_fts.rowid
+  JOIN filetrack AS ft ON ft.file_id = fn.file_id
+  WHERE filenames_fts MATCH ?1
+) AS m ON m.id = filetrack.id
+GROUP BY filetrack.id
+ORDER BY min(m.rank), filetrack.id"""
+
+FILES_LIKE = """SELECT filepath, last_seen_dt FROM filetrack
+WHERE filepath LIKE ?"""
+
+# History events, as listed by latest and search, see `events_sql`.
+EVENTS = """SELECT
+filepath, start_dt, stop_dt, play_secs, h.grip, grip_count, h.id,
+coalesce(grip_spec, h.grip) AS grip_spec
+FROM history AS h
+JOIN filetrack ON filetrack.id = h.ftrack_id
+JOIN grip_counts AS gc ON gc.grip = h.grip
+{}
+ORDER BY start_dt {order}, h.id {order} LIMIT ? OFFSET ?"""
+
+EVENTS_FTS_COND = """h.ftrack_id IN
+(SELECT rowid FROM filetrack_fts WHERE filetrack_fts MATCH ?)"""
+
+EVENTS_LIKE_COND = "filepath LIKE ?"
+
+FILE_NAMES = """SELECT hash, name FROM files
+JOIN filenames ON filenames.file_id = files.id
+{}
+ORDER BY files.id, filenames.id"""
+
+COUNTS = """SELECT
+(SELECT count(id) FROM history) AS events,
+(SELECT count(id) FROM files) AS files,
+(SELECT count(id) FROM filetrack) AS filepaths,
+(SELECT coalesce(sum(play_secs), 0) FROM play_days) AS play_secs"""
+
+# Last known (filetrack ID, st_size, st_mtime_ns) of a JSON array of filepaths.
+KNOWN_SIGNATURES = """SELECT filepath, id, st_size, st_mtime_ns FROM filetrack
+WHERE filepath IN (SELECT value FROM json_each(?))
+ORDER BY last_seen_dt"""
+
+# The next ?2 finished events after history ID ?1.
+CLOSED_EVENTS = """SELECT id, file_id, ftrack_id, start_dt, stop_dt, grip
+FROM history
+WHERE stop_dt IS NOT NULL AND id > ?
+ORDER BY id LIMIT ?"""
+
+MAX_HISTORY_ID = "SELECT coalesce(max(id), 0) FROM history"
+
+def events_sql(conds, descending=False):
+    return EVENTS.format(
+        "WHERE " + " AND ".join(conds) if conds else "",
+        order="DESC" if descending else "ASC"
+    )
+
+def file_names_sql(cond=None):
+    return FILE_NAMES.format("WHERE " + cond if cond else "")
+
+
+##### INGEST #####
+
+CREATE_INGEST = """CREATE TEMP TABLE IF NOT EXISTS
+ingest(
+  pos INTEGER PRIMARY KEY,
+  hash TEXT NOT NULL,
+  filename TEXT NOT NULL,
+  filepath TEXT NOT NULL,
+  st_size INTEGER,
+  st_mtime_ns INTEGER,
+  file_id INTEGER,
+  ftrack_id INTEGER
+)"""
+
+CLEAR_INGEST = "DELETE FROM temp.ingest"
+
+FILL_INGEST = """INSERT INTO
+temp.ingest(hash, filename, filepath, st_size, st_mtime_ns)
+VALUES(?, ?, ?, ?, ?)"""
+
+INSERT_FILES = """INSERT INTO files(hash)
+SELECT hash FROM temp.ingest WHERE true ORDER BY pos
+ON CONFLICT(hash) DO NOTHING"""
+
+SET_INGEST_FILE_IDS = """UPDATE temp.ingest SET file_id =
+(SELECT id FROM files WHERE files.hash = ingest.hash)"""
+
+# New names for known files count as renames, see `filenames_renames`.
+INSERT_FILENAMES = """INSERT INTO filenames(file_id, name, first_seen_dt)
+SELECT file_id, filename, ? FROM temp.ingest WHERE true ORDER BY pos
+ON CONFLICT(file_id, name) DO NOTHING"""
+
+UPSERT_FILETRACK = """INSERT INTO filetrack(
+  file_id, filepath, first_seen_dt, last_seen_dt, st_size, st_mtime_ns
+)
+SELECT DISTINCT file_id, filepath, ?1, ?1, st_size, st_mtime_ns
+FROM temp.ingest WHERE true
+ON CONFLICT(file_id, filepath) DO UPDATE SET last_seen_dt=?1,
+st_size=coalesce(excluded.st_size, st_size),
+st_mtime_ns=coalesce(excluded.st_mtime_ns, st_mtime_ns)"""
+
+SET_INGEST_FTRACK_IDS = """UPDATE temp.ingest SET ftrack_id =
+(SELECT id FROM filetrack WHERE filetrack.file_id = ingest.file_id
+AND filetrack.filepath = ingest.filepath)"""
+
+TOUCH_FILETRACK = """UPDATE filetrack SET last_seen_dt=?
+WHERE id IN (SELECT value FROM json_each(?))"""
+
+
+##### HISTORY #####
+
+INSERT_STARTS = """INSERT INTO history(file_id, ftrack_id, start_dt, grip)
+SELECT file_id, ftrack_id, ?1, start_grip(file_id, ftrack_id, ?1)
+FROM temp.ingest ORDER BY pos
+RETURNING id"""
+
+UPDATE_STOPS = """UPDATE history SET stop_dt=?1, play_secs=?2,
+grip=stop_grip(id, file_id, ftrack_id, start_dt, ?1)
+WHERE id IN (SELECT value FROM json_each(?3))"""
+
+SET_GRIP = "UPDATE history SET grip=? WHERE id=?"
+
+# Grips of a JSON array that more than one event goes by.
+GRIP_COLLISIONS = """SELECT grip, grip_count FROM grip_counts
+WHERE grip IN (SELECT value FROM json_each(?)) AND grip_count > 1
+ORDER BY grip"""
+
+CREATE_GRIP_SPECS = """CREATE TEMP TABLE IF NOT EXISTS
+grip_specs(
+  pos INTEGER PRIMARY KEY,
+  spec TEXT NOT NULL,
+  grip TEXT NOT NULL,
+  start_lo NOT NULL,
+  start_hi NOT NULL
+)"""
+
+CLEAR_GRIP_SPECS = "DELETE FROM temp.grip_specs"
+
+FILL_GRIP_SPECS = """INSERT INTO
+temp.grip_specs(spec, grip, start_lo, start_hi)
+VALUES(?, ?, ?, ?)"""
+
+RESOLVE_GRIP_SPECS = """SELECT s.spec, h.id, h.grip, h.start_dt, filepath
+FROM temp.grip_specs AS s
+JOIN history AS h ON h.grip = s.grip
+AND h.start_dt >= s.start_lo AND h.start_dt < s.start_hi
+JOIN filetrack ON filetrack.id = h.ftrack_id
+ORDER BY s.pos, h.start_dt"""
+
+DELETE_EVENTS = """DELETE FROM history
+WHERE id IN (SELECT value FROM json_each(?))"""
+
+
+##### CLEANUP #####
+
+# Anti-joins for filepaths and files no longer referenced from history.
+UNREFERENCED = (
+    ("filetrack", """SELECT id FROM filetrack AS ft WHERE NOT EXISTS
+(SELECT 1 FROM history WHERE history.ftrack_id = ft.id)"""),
+    ("files", """SELECT id FROM files AS f WHERE NOT EXISTS
+(SELECT 1 FROM history WHERE history.file_id = f.id)"""),
+)
+
+COUNT_UNREFERENCED = "SELECT count(*) FROM ({})"
+
+DELETE_UNREFERENCED = "DELETE FROM {} WHERE id IN ({} LIMIT ?)"
+
+CREATE_PURGE_HASHES = """CREATE TEMP TABLE IF NOT EXISTS
+purge_hashes(hash TEXT PRIMARY KEY)"""
+
+CLEAR_PURGE_HASHES = "DELETE FROM temp.purge_hashes"
+
+FILL_PURGE_HASHES = "INSERT OR IGNORE INTO temp.purge_hashes VALUES(?)"
+
+PURGE_HASHES_COND = "hash IN (SELECT hash FROM temp.purge_hashes)"
+
+DELETE_PURGED_FILES = "DELETE FROM files WHERE " + PURGE_HASHES_COND
+
+
+##### ANALYTICS #####
+
+# Local day an event started on, as rolled up into play_days by the triggers
+# of schema migration 8.
+LOCAL_DAY = """CASE typeof(start_dt)
+  WHEN 'integer' THEN date(start_dt / 1000000, 'unixepoch', 'localtime')
+  ELSE date(start_dt, 'localtime') END"""
+
+# Per period, how to bucket days and the first day of the current period.
+PLAY_PERIODS = {
+    "days": ("day", "date('now', 'localtime')"),
+    "weeks": ("date(day, '-6 days', 'weekday 1')",
+              "date('now', 'localtime', '-6 days', 'weekday 1')"),
+    "months": ("substr(day, 1, 7)",
+               "date('now', 'localtime', 'start of month')"),
+}
+
+# Play time per period, from the start of the period ?-many days/months back.
+PLAYS = """SELECT {} AS period, sum(events) AS events,
+sum(play_secs) AS play_secs
+FROM play_days WHERE day >= date({}, ?)
+GROUP BY period ORDER BY period DESC"""
+
+LATEST_NAME = """(SELECT name FROM filenames WHERE file_id = files.id
+ORDER BY id DESC LIMIT 1)"""
+
+TOP_FILES = """SELECT hash, """ + LATEST_NAME + """ AS name, events,
+file_plays.play_secs AS play_secs
+FROM file_plays JOIN files ON files.id = file_plays.file_id
+ORDER BY file_plays.play_secs DESC, file_plays.file_id DESC LIMIT ?"""
+
+RENAMED_FILES = """SELECT hash, """ + LATEST_NAME + """ AS name, renames
+FROM files WHERE renames > 0
+ORDER BY renames DESC, id DESC LIMIT ?"""
+
+CLEAR_PLAY_DAYS = "DELETE FROM play_days"
+
+FILL_PLAY_DAYS = """INSERT INTO play_days
+SELECT """ + LOCAL_DAY + """ AS day, count(id), sum(play_secs)
+FROM history WHERE play_secs NOT NULL
+GROUP BY day"""
+
+CLEAR_FILE_PLAYS = "DELETE FROM file_plays"
+
+FILL_FILE_PLAYS = """INSERT INTO file_plays
+SELECT file_id, count(id), sum(play_secs)
+FROM history WHERE play_secs NOT NULL
+GROUP BY file_id"""
+
+# Every name after a file's first counts as a rename.
+RECOUNT_RENAMES = """UPDATE files SET renames = c.renames
+FROM (
+  SELECT file_id, count(id) - 1 AS renames FROM filenames
+  GROUP BY file_id
+) AS c
+WHERE c.file_id = files.id AND files.renames <> c.renames"""
+
+def plays_sql(period):
+    return PLAYS.format(*PLAY_PERIODS[period])
+
+
+##### SCHEMA #####
+
+TABLE_SQL = "SELECT sql FROM sqlite_schema WHERE type = 'table' AND name = ?"
+
+# Indices and triggers on a table, as created.
+TABLE_DEPENDENTS = """SELECT sql FROM sqlite_schema WHERE tbl_name = ?
+AND type IN ('index', 'trigger') AND sql NOT NULL"""
+
+VIEWS = "SELECT name, sql FROM sqlite_schema WHERE type = 'view'"
+
+TABLE_COLUMNS = "SELECT name FROM pragma_table_info(?)"
+
+COPY_TABLE = "INSERT INTO {} SELECT {} FROM {}"
+
+DROP_VIEW = "DROP VIEW {}"
+
+DROP_TABLE = "DROP TABLE {}"
+
+RENAME_TABLE = "ALTER TABLE {} RENAME TO {}"
+
+FOREIGN_KEY_CHECK = "PRAGMA foreign_key_check"
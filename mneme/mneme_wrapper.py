@@ -1,94 +1,86 @@
 #!/usr/bin/env python
 
-import json, subprocess, sys
+import sqlite3, sys, time
+from concurrent.futures import ThreadPoolExecutor
 from os import path
 
 from mnemedt import mnemedt
-from mneme_common import CONFIG, initialize_sqlite
-from mneme_digests import history_grip, sampling_hash
+from mneme_cache import open_digest_cache
+from mneme_common import (
+    CONFIG, initialize_sqlite, retry_busy, to_db, write_transaction
+)
+from mneme_digests import batch_hash, history_grip
+from mneme_funcs import print_hash_error
+from mneme_sql import (
+    CLEAR_INGEST, CREATE_INGEST, FILL_INGEST, INSERT_FILENAMES, INSERT_FILES,
+    INSERT_STARTS, SET_INGEST_FILE_IDS, SET_INGEST_FTRACK_IDS, UPDATE_STOPS,
+    UPSERT_FILETRACK
+)
 
 
 ##### DATABASE FUNCTIONS #####
 
-def json_serialize(lst_or_str):
-    if isinstance(lst_or_str, str):
-        to_dump = [lst_or_str]
-    elif isinstance(lst_or_str, list):
-        to_dump = lst_or_str
-    else:
-        raise ValueError("Unexpected type for serialization")
-
-    return json.dumps(to_dump, ensure_ascii=False)
-
-def update_filenames(cur, f_id, filenames, new_filename):
-    curr_names = json.loads(filenames)
-    if not new_filename in curr_names:
-        curr_names.append(new_filename)
-        cur.execute(
-            "UPDATE files SET filenames=?, renames=renames+1 where id=?",
-            (json_serialize(curr_names), f_id)
-        )
-
-def get_file_id(cur, fpath):
-    file_hash = sampling_hash(fpath)
-    filename = path.basename(fpath)
-
-    result = cur.execute(
-        "SELECT id, filenames FROM files WHERE hash=?", (file_hash,)
-    ).fetchone()
-
-    if result:
-        file_id = result[0]
-        update_filenames(cur, file_id, result[1], filename)
-    else:
-        cur.execute(
-            "INSERT INTO files(hash, filenames) VALUES(?, ?)",
-            (file_hash, json_serialize(filename))
-        )
-        file_id = cur.lastrowid
-
-    return file_id
-
-def update_filetrack(cur, file_id, fpath, timestamp):
-    fullpath = path.abspath(fpath)
-    ts = str(timestamp)
-
-    result = cur.execute(
-        """INSERT INTO filetrack VALUES(NULL, ?, ?, ?, ?)
-        ON CONFLICT(file_id, filepath) DO UPDATE SET last_seen_dt=?
-        RETURNING id""",
-        (file_id, fullpath, ts, ts, ts)
-    ).fetchone()
-    return result[0]
-
-def record_start(cur, file_id, ftrack_id, timestamp_start):
-    ts = str(timestamp_start)
-    # Compute (temporary) grip for history event.
-    grip = history_grip( (file_id, ftrack_id), (ts,) )
+def register_grip_functions(conn):
+    # Exposes grip computation to SQL, so history records can be inserted and
+    # closed set-wise, instead of row by row.
+    conn.create_function(
+        "start_grip", 3,
+        lambda f_id, ft_id, start: history_grip( (f_id, ft_id), (start,) ),
+        deterministic=True
+    )
+    conn.create_function(
+        "stop_grip", 5,
+        lambda h_id, f_id, ft_id, start, stop:
+            history_grip( (h_id, f_id, ft_id), (start, stop) ),
+        deterministic=True
+    )
 
-    # Record into history what we're watching and when we started.
+def hash_files(filepaths, cache=None):
+    hashed = []
+    for fpath, file_hash, err in batch_hash(
+            filepaths, CONFIG.hash_workers, cache):
+        if err:
+            print_hash_error(fpath, err)
+        else:
+            hashed.append( (fpath, file_hash) )
+    return hashed
+
+def ingest_files(cur, hashed, timestamp, signatures=None):
+    # Resolves file and filetrack IDs for a batch of (filepath, hash) pairs,
+    # creating or updating records as necessary. Results are left in the
+    # temporary ingest table, in the same order as passed. Signatures map
+    # filepaths to their (st_size, st_mtime_ns), when known.
+    ts = to_db(timestamp)
+    signatures = signatures or {}
+    cur.execute(CREATE_INGEST)
+    cur.execute(CLEAR_INGEST)
+    cur.executemany(
+        FILL_INGEST,
+        ( (file_hash, path.basename(fpath), path.abspath(fpath))
+          + signatures.get(fpath, (None, None))
+          for fpath, file_hash in hashed )
+    )
+    cur.execute(INSERT_FILES)
+    cur.execute(SET_INGEST_FILE_IDS)
+    cur.execute(INSERT_FILENAMES, (ts,))
+    cur.execute(UPSERT_FILETRACK, (ts,))
+    cur.execute(SET_INGEST_FTRACK_IDS)
+
+def record_starts(cur, timestamp_start):
+    # Record into history what we're watching and when we started, along with
+    # a (temporary) grip for each history event.
+    results = cur.execute(INSERT_STARTS, (to_db(timestamp_start),)).fetchall()
+    return [row[0] for row in results]
+
+def record_stops(cur, hist_ids, timestamp_stop, play_time):
+    import json
+    play_secs = int(play_time.total_seconds() + 0.5)
+    # Update history records: when we stopped, how long we were watching and
+    # the final grip for each history event.
     cur.execute(
-        """INSERT INTO history(file_id, ftrack_id, start_dt, grip)
-        VALUES(?, ?, ?, ?)""",
-        (file_id, ftrack_id, ts, grip)
+        UPDATE_STOPS,
+        (to_db(timestamp_stop), play_secs, json.dumps(hist_ids))
     )
-    return cur.lastrowid
-
-def record_stop(cur, hist_id, timestamp_stop, play_time):
-    ts = str(timestamp_stop)
-    # Fetch necessary values and compute final grip for history event.
-    result = cur.execute(
-        "SELECT id, file_id, ftrack_id, start_dt FROM history WHERE id=?",
-        (hist_id,)
-    ).fetchone()
-    if result:
-        grip = history_grip( result[:3], (result[3], ts) )
-        # Update history record: when we stopped and how long we were watching.
-        play_secs = int(play_time.total_seconds() + 0.5)
-        cur.execute(
-            "UPDATE history SET stop_dt=?, play_secs=?, grip=? WHERE id=?",
-            (ts, play_secs, grip, hist_id)
-        )
 
 
 ##### SCRIPT #####
@@ -106,34 +98,111 @@ def yield_files():
         elif mode == "pass" and path.isfile(arg):
             yield arg
 
+class wrapper_timer:
+    def __init__(self):
+        self.overhead = 0.0
+        self.lock_wait = 0.0
+        self.retries = 0
+
+    def retry(self, delay):
+        self.retries += 1
+
+    def report(self):
+        print(
+            "mneme: bookkeeping took {:.1f} ms ".format(self.overhead * 1000) +
+            "({:.1f} ms waiting on lock, {} retries)."
+            .format(self.lock_wait * 1000, self.retries),
+            file=sys.stderr
+        )
+
+def timed_transaction(conn, timer, fn, *args):
+    # Runs fn in a write transaction, counting the time until it starts (or
+    # BEGIN gives up) as waiting on the write lock.
+    t0 = time.perf_counter()
+    started = []
+    def timed(cur, *args):
+        started.append(time.perf_counter())
+        return fn(cur, *args)
+    try:
+        return write_transaction(conn, timed, *args)
+    finally:
+        t1 = started[0] if started else time.perf_counter()
+        timer.lock_wait += t1 - t0
+
+def ingest_and_start(cur, hashed, timestamp):
+    ingest_files(cur, hashed, timestamp)
+    return record_starts(cur, timestamp)
+
+def open_db(timer):
+    conn = retry_busy(initialize_sqlite, on_retry=timer.retry)
+    register_grip_functions(conn)
+    return conn
+
+def record_launch(timestamp, timer):
+    t0 = time.perf_counter()
+    # Hash everything before we take the write lock. The cache only saves us
+    # time, a locked or unwritable one mustn't cost us the media events.
+    try:
+        cache = open_digest_cache()
+    except (OSError, sqlite3.Error) as ex:
+        print("mneme: hashing without digest cache: {}".format(ex),
+              file=sys.stderr)
+        cache = None
+    hashed = hash_files(yield_files(), cache)
+    if cache:
+        try:
+            cache.close()
+        except sqlite3.Error as ex:
+            print("mneme: unable to update digest cache: {}".format(ex),
+                  file=sys.stderr)
+
+    conn = open_db(timer)
+    try:
+        hist_ids = retry_busy(
+            timed_transaction, conn, timer, ingest_and_start, hashed,
+            timestamp, on_retry=timer.retry
+        )
+    finally:
+        conn.close()
+    timer.overhead += time.perf_counter() - t0
+    return hist_ids
+
 def run_wrapper():
+    import subprocess
     before = mnemedt.now()
     # Media player START!
     media_player = subprocess.Popen([CONFIG.media_player] + sys.argv[1:])
 
-    conn = initialize_sqlite()
-    cur = conn.cursor()
-
-    # We manually start our (write) transaction here, because we start off with
-    # a SELECT query, and we don't want any writes sneaking in between the
-    # SELECT and subsequent INSERT/UPDATE statements.
-    cur.execute("BEGIN IMMEDIATE")
-    hist_ids = []
-    for filepath in yield_files():
-        file_id = get_file_id(cur, filepath)
-        ftrack_id = update_filetrack(cur, file_id, filepath, before)
-
-        hist_ids.append(record_start(cur, file_id, ftrack_id, before))
-    conn.commit()
-
-    # Media player STOP!
-    media_player.wait()
-    after = mnemedt.now()
-    play_time = after - before
-
-    for hist_id in hist_ids:
-        record_stop(cur, hist_id, after, play_time)
-    conn.commit()
+    # Record the start of the media events in the background, so neither the
+    # player nor we have to wait on hashing or a locked database.
+    timer = wrapper_timer()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        launch = pool.submit(record_launch, before, timer)
+
+        # Media player STOP!
+        media_player.wait()
+        after = mnemedt.now()
+        play_time = after - before
+
+    try:
+        hist_ids = launch.result()
+        t0 = time.perf_counter()
+        conn = open_db(timer)
+        try:
+            retry_busy(
+                timed_transaction, conn, timer, record_stops,
+                hist_ids, after, play_time,
+                on_retry=timer.retry
+            )
+        finally:
+            conn.close()
+        timer.overhead += time.perf_counter() - t0
+    except sqlite3.Error as ex:
+        print("mneme: unable to record media events: {}".format(ex),
+              file=sys.stderr)
+
+    if CONFIG.log_timings:
+        timer.report()
 
 if __name__ == "__main__":
     run_wrapper()
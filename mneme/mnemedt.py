@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 
 class mnemedt:
     # DateTime format for serializing to the DB.
     _dtformat = "%Y-%m-%dT%H:%M:%S.%fZ"
+    # Or, for DBs storing timestamps as integers, microseconds since this.
+    _epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
     def __init__(self, dt_val):
         if dt_val.tzinfo != timezone.utc:
@@ -20,6 +22,26 @@ class mnemedt:
     def fromstr(dt_str):
         return mnemedt(datetime.fromisoformat(dt_str))
 
+    @staticmethod
+    def fromint(dt_int):
+        return mnemedt(mnemedt._epoch + timedelta(microseconds=dt_int))
+
+    @staticmethod
+    def fromdb(value):
+        # Timestamps as stored, either as text or as integer microseconds.
+        if isinstance(value, int):
+            return mnemedt.fromint(value)
+        else:
+            return mnemedt.fromstr(value)
+
+    @staticmethod
+    def parse(dt_str):
+        # Parses user input, datetimes without timezone are taken as local.
+        dt = datetime.fromisoformat(dt_str)
+        if dt.tzinfo is None:
+            dt = dt.astimezone()
+        return mnemedt(dt.astimezone(timezone.utc))
+
     def localdt(self):
         return self.datetime.astimezone()
 
@@ -34,6 +56,11 @@ class mnemedt:
     def __sub__(self, other):
         return self.datetime - other.datetime
 
+    def __int__(self):
+        delta = self.datetime - self._epoch
+        return ((delta.days * 86400 + delta.seconds) * 1000000
+                + delta.microseconds)
+
     def __str__(self):
         return self.datetime.strftime(self._dtformat)
 
@@ -0,0 +1,45 @@
+import random, sqlite3
+
+import pytest
+
+from mneme_common import migrate, set_timestamp_mode
+import mneme_fixtures
+
+
+@pytest.fixture(scope="session", autouse=True)
+def home(tmp_path_factory):
+    # Keep the config, database and caches of whoever runs the tests out of
+    # reach. The config is only loaded once, so this is for the whole session.
+    home = tmp_path_factory.mktemp("home")
+    (home / ".config").mkdir()
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("HOME", str(home))
+        yield home
+
+@pytest.fixture(autouse=True)
+def text_timestamps():
+    # The timestamp mode is global, don't let it leak between tests.
+    yield
+    set_timestamp_mode("text")
+
+@pytest.fixture
+def scratch_db():
+    conn = mneme_fixtures.scratch_db()
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def synthetic_db(tmp_path):
+    # A migrated DB file with some history in it, the same every time.
+    db_file = str(tmp_path / "mneme.sqlite")
+    conn = sqlite3.connect(db_file)
+    migrate(conn)
+    conn.close()
+    mneme_fixtures.synthetic_db(db_file, 50, 100, 2000, random.Random(0))
+    return db_file
+
+@pytest.fixture
+def grips_db():
+    conn = mneme_fixtures.grips_db(2000)
+    yield conn
+    conn.close()
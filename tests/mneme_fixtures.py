@@ -0,0 +1,255 @@
+# Test fixtures and the legacy implementations new code is checked against.
+# `mneme bench` times against the same ones, so they're plain functions.
+
+import math, random, sqlite3
+from os import path
+
+from mneme_common import migrate
+from mneme_digests import (
+    CK_SAMPLE_SIZE, SKIP_VALUES, history_grip, sampling_hash
+)
+from mneme_misc import calc_grips
+from mnemedt import mnemedt
+import mneme_sql as sql
+
+
+##### ESCAPING #####
+
+def synthetic_paths(count, seed=0):
+    rnd = random.Random(seed)
+    words = ("Season", "Episode", "Movies", "Series", "Concert", "Live",
+             "Director's Cut", "1080p", "x265", "Documentary")
+    paths = []
+    for i in range(count):
+        name = " ".join(rnd.choices(words, k=4))
+        # Only a small fraction of paths has anything that needs escaping.
+        if rnd.random() < 0.02:
+            name = name.replace(" ", "\t", 1) + "\\"
+        paths.append("/media/library/{}/{:05}.mkv".format(name, i))
+    return paths
+
+def legacy_replace_ws(s):
+    # Character by character escaping, as replace_ws used to work.
+    val = [c for c in s]
+    for i in range(len(val)):
+        match ord(val[i]):
+            case 0x9:
+                val[i] = r'\t'
+            case 0xA:
+                val[i] = r'\n'
+            case 0xD:
+                val[i] = r'\r'
+            case 0x5C:
+                val[i] = r'\\'
+    return ''.join(val)
+
+
+##### DIGESTS #####
+
+def sparse_files(directory, sizes):
+    # Sparse files of the given sizes, with a few marked blocks so samples
+    # actually differ.
+    filepaths = []
+    for size in sizes:
+        filepath = path.join(directory, "{}.bin".format(size))
+        with open(filepath, "wb") as f:
+            f.truncate(size)
+            for loc in range(0, size, size // 7 or 1):
+                f.seek(loc)
+                f.write(loc.to_bytes(8, "little"))
+        filepaths.append(filepath)
+    return filepaths
+
+def hash_all(filepaths, sampler):
+    results = []
+    for filepath in filepaths:
+        try:
+            results.append(sampling_hash(filepath, sampler))
+        except OSError as ex:
+            results.append(ex.errno)
+    return results
+
+def legacy_sample_locations(filesize):
+    # Linear scan insertion of the midpoint, as sample_locations used to work.
+    end_location = filesize - CK_SAMPLE_SIZE
+    skip_list = [0]
+    curr_skip = SKIP_VALUES[0]
+    while curr_skip < end_location:
+        skip_list.append(curr_skip)
+        curr_skip = curr_skip * SKIP_VALUES[1]
+    skip_list.append(end_location)
+    middle = math.floor(filesize / 2)
+    for i in range(len(skip_list) - 1):
+        if middle > skip_list[i] and middle < skip_list[i + 1]:
+            skip_list.insert(i + 1, middle)
+            break
+    return skip_list
+
+
+##### INGEST #####
+
+def legacy_record_launch(cur, hashed, timestamp):
+    # One file at a time, against the original schema, as the wrapper used to
+    # record a launch. Returns the history IDs.
+    import json
+    ts = str(timestamp)
+    hist_ids = []
+    for fpath, file_hash in hashed:
+        filename = path.basename(fpath)
+        result = cur.execute(
+            "SELECT id, filenames FROM files WHERE hash=?", (file_hash,)
+        ).fetchone()
+        if result:
+            file_id = result[0]
+            names = json.loads(result[1])
+            if filename not in names:
+                cur.execute(
+                    "UPDATE files SET filenames=?, renames=renames+1 "
+                    "WHERE id=?",
+                    (json.dumps(names + [filename], ensure_ascii=False),
+                     file_id)
+                )
+        else:
+            cur.execute(
+                "INSERT INTO files(hash, filenames) VALUES(?, ?)",
+                (file_hash, json.dumps([filename], ensure_ascii=False))
+            )
+            file_id = cur.lastrowid
+        ftrack_id = cur.execute(
+            """INSERT INTO filetrack VALUES(NULL, ?, ?, ?, ?)
+            ON CONFLICT(file_id, filepath) DO UPDATE SET last_seen_dt=?
+            RETURNING id""",
+            (file_id, path.abspath(fpath), ts, ts, ts)
+        ).fetchone()[0]
+        cur.execute(
+            """INSERT INTO history(file_id, ftrack_id, start_dt, grip)
+            VALUES(?, ?, ?, ?)""",
+            (file_id, ftrack_id, ts, history_grip((file_id, ftrack_id), (ts,)))
+        )
+        hist_ids.append(cur.lastrowid)
+    return hist_ids
+
+def legacy_record_stops(cur, hist_ids, timestamp_stop, play_time):
+    ts = str(timestamp_stop)
+    play_secs = int(play_time.total_seconds() + 0.5)
+    for hist_id in hist_ids:
+        row = cur.execute(
+            "SELECT id, file_id, ftrack_id, start_dt FROM history WHERE id=?",
+            (hist_id,)
+        ).fetchone()
+        cur.execute(
+            "UPDATE history SET stop_dt=?, play_secs=?, grip=? WHERE id=?",
+            (ts, play_secs, history_grip(row[:3], (row[3], ts)), hist_id)
+        )
+
+
+##### DATABASES #####
+
+def placeholder_grip(i):
+    # Grip for fixture events that don't need a real one. These have to be
+    # unique, as each event sharing a grip has the triggers recompute
+    # grip-specs over all others with it, making bulk loads quadratic.
+    return "-{}".format(i)
+
+def scratch_db():
+    # An empty, fully migrated in-memory DB, with everything the statements
+    # need to prepare.
+    conn = sqlite3.connect(":memory:")
+    migrate(conn)
+    for stmt in (sql.CREATE_INGEST, sql.CREATE_GRIP_SPECS,
+                 sql.CREATE_PURGE_HASHES):
+        conn.execute(stmt)
+    conn.create_function("start_grip", 3, lambda *args: "")
+    conn.create_function("stop_grip", 5, lambda *args: "")
+    return conn
+
+def grips_db(count):
+    # Scratch DB with count closed events, all with the wrong grip.
+    rnd = random.Random(0)
+    conn = scratch_db()
+    conn.executemany("INSERT INTO files(hash) VALUES(?)",
+                     (("{:032x}".format(i),) for i in range(100)))
+    conn.execute("INSERT INTO filetrack(file_id, filepath, first_seen_dt, "
+                 "last_seen_dt) SELECT id, hash, '', '' FROM files")
+    now = int(mnemedt.now())
+    def events():
+        for i in range(count):
+            start = now - rnd.randrange(730 * 86400 * 10**6)
+            stop = start + rnd.randrange(1, 3600 * 10**6)
+            file_id = rnd.randrange(1, 101)
+            yield (file_id, file_id, str(mnemedt.fromint(start)),
+                   str(mnemedt.fromint(stop)), placeholder_grip(i))
+    conn.executemany("INSERT INTO history(file_id, ftrack_id, start_dt, "
+                     "stop_dt, grip) VALUES(?, ?, ?, ?, ?)", events())
+    conn.commit()
+    return conn
+
+def synthetic_db(db_file, files, filepaths, events, rnd):
+    # Fills a fresh mneme DB with files (some renamed a few times), their
+    # filepaths (the last tenth never played, for cleanup to find) and closed
+    # history events with real grips, one in a hundred colliding with the
+    # event before it. Returns what it made.
+    conn = sqlite3.connect(db_file)
+    paths = synthetic_paths(filepaths, rnd.random())
+    now = int(mnemedt.now())
+    day = 86400 * 10**6
+
+    conn.executemany("INSERT INTO files(hash) VALUES(?)",
+                     (("{:032x}".format(rnd.getrandbits(128)),)
+                      for i in range(files)))
+    # Every file gets a filepath, the rest go to files at random. Each file's
+    # own filepath comes last, so some files are never played at all.
+    owners = [rnd.randrange(1, files + 1) for i in range(filepaths - files)]
+    owners += range(1, files + 1)
+    seen = str(mnemedt.fromint(now - 1000 * day))
+    conn.executemany(
+        "INSERT INTO filenames(file_id, name, first_seen_dt) "
+        "VALUES(?, ?, ?) ON CONFLICT DO NOTHING",
+        ((file_id, path.basename(fpath), seen)
+         for file_id, fpath in zip(owners, paths))
+    )
+    conn.executemany(
+        "INSERT INTO filetrack(file_id, filepath, first_seen_dt, "
+        "last_seen_dt) VALUES(?, ?, ?, ?)",
+        ((file_id, fpath, seen, seen) for file_id, fpath in zip(owners, paths))
+    )
+    conn.executemany(
+        "INSERT INTO filenames(file_id, name, first_seen_dt) "
+        "VALUES(?, ?, ?) ON CONFLICT DO NOTHING",
+        ((rnd.randrange(1, files + 1), "renamed {}.mkv".format(i), seen)
+         for i in range(files // 10 * 2))
+    )
+
+    played = conn.execute(
+        "SELECT id, file_id FROM filetrack ORDER BY id LIMIT ?",
+        (max(filepaths * 9 // 10, 1),)
+    ).fetchall()
+    starts = sorted(now - rnd.randrange(1000 * day) for i in range(events))
+    def rows():
+        for i, start in enumerate(starts):
+            ftrack_id, file_id = rnd.choice(played)
+            play_secs = rnd.randrange(60, 7200)
+            yield (file_id, ftrack_id, str(mnemedt.fromint(start)),
+                   str(mnemedt.fromint(start + play_secs * 10**6)),
+                   play_secs, placeholder_grip(i))
+    conn.executemany(
+        "INSERT INTO history(file_id, ftrack_id, start_dt, stop_dt, "
+        "play_secs, grip) VALUES(?, ?, ?, ?, ?, ?)", rows()
+    )
+    conn.commit()
+    for chunk in calc_grips(conn, 10000):
+        pass
+    conn.execute("UPDATE history SET grip = (SELECT grip FROM history AS o "
+                 "WHERE o.id = history.id - 1) WHERE id % 100 = 0")
+    conn.commit()
+
+    counts = sql.typed(conn.cursor(), sql.db_counts).execute(sql.COUNTS)
+    made = counts.fetchone()._asdict()
+    del made["play_secs"]
+    made["renames"] = conn.execute(
+        "SELECT sum(renames) FROM files").fetchone()[0]
+    made["colliding_events"] = conn.execute(
+        "SELECT count(id) FROM history WHERE grip_spec NOT NULL"
+    ).fetchone()[0]
+    conn.close()
+    return made
@@ -0,0 +1,51 @@
+import sqlite3
+
+import pytest
+
+from mneme_analytics import rebuild_rollups
+from mneme_common import retry_busy
+
+
+def rollups(conn):
+    return (conn.execute("SELECT * FROM play_days ORDER BY day").fetchall(),
+            conn.execute("SELECT * FROM file_plays ORDER BY file_id")
+            .fetchall(),
+            conn.execute("SELECT id, renames FROM files ORDER BY id")
+            .fetchall())
+
+def test_rollups_follow_history(synthetic_db):
+    conn = sqlite3.connect(synthetic_db)
+    # Everything through the triggers: inserts, stops, moves, then deletes.
+    conn.execute("INSERT INTO history(file_id, ftrack_id, start_dt, grip) "
+                 "SELECT file_id, ftrack_id, start_dt, grip FROM history "
+                 "WHERE id % 7 = 0")
+    conn.execute("UPDATE history SET play_secs = 60 WHERE play_secs IS NULL "
+                 "AND id % 2 = 0")
+    conn.execute("UPDATE history SET file_id = 1, ftrack_id = 1 "
+                 "WHERE id % 11 = 0")
+    conn.execute("DELETE FROM history WHERE id % 10 = 0")
+    conn.execute("INSERT INTO filenames(file_id, name, first_seen_dt) "
+                 "VALUES(1, 'yet another name.mkv', '')")
+    conn.commit()
+
+    maintained = rollups(conn)
+    assert conn.execute("SELECT sum(play_secs) FROM play_days").fetchone() \
+        == conn.execute("SELECT sum(play_secs) FROM history").fetchone()
+    rebuild_rollups(conn)
+    assert rollups(conn) == maintained
+
+def test_rebuild_retries_busy_commit(synthetic_db):
+    conn = sqlite3.connect(synthetic_db, timeout=0, isolation_level=None)
+    expected = rollups(conn)
+    conn.execute("DELETE FROM play_days")
+    # A reader mid-query keeps its shared lock, so our COMMIT can't get the
+    # exclusive one (no WAL here), and the whole rebuild has to be retried.
+    reader = sqlite3.connect(synthetic_db)
+    rows = reader.execute("SELECT * FROM history")
+    rows.fetchone()
+    with pytest.raises(sqlite3.OperationalError):
+        rebuild_rollups(conn)
+    assert not conn.in_transaction
+    assert retry_busy(rebuild_rollups, conn,
+                      on_retry=lambda delay: rows.close()) is None
+    assert rollups(conn) == expected
@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+import pytest
+
+import mneme_cache
+from mneme_cache import cache_counters, digest_cache
+
+
+@pytest.fixture
+def cache_file(tmp_path, monkeypatch):
+    cache_file = tmp_path / "cache" / "digests.sqlite"
+    monkeypatch.setattr(mneme_cache, "CONFIG",
+                        SimpleNamespace(digest_cache=cache_file))
+    return cache_file
+
+def test_counters_without_cache(cache_file):
+    assert cache_counters() is None
+    assert not cache_file.parent.exists()
+
+def test_counters(cache_file, tmp_path):
+    media = tmp_path / "media.mkv"
+    media.write_bytes(b"\0" * 100000)
+    for i in range(3):
+        cache_file.parent.mkdir(exist_ok=True)
+        cache = digest_cache(cache_file, 100, 30)
+        cache.sampling_hash(str(media))
+        cache.close()
+    assert cache_counters() == (2, 1)
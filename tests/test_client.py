@@ -0,0 +1,86 @@
+import json
+import socket
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import mneme_client
+from mneme_client import call_daemon
+
+
+@pytest.fixture
+def sock_path(tmp_path, monkeypatch):
+    sock_path = str(tmp_path / "mneme.sock")
+    monkeypatch.setattr(mneme_client, "CONFIG",
+                        SimpleNamespace(daemon_socket=sock_path))
+    return sock_path
+
+def serve_once(sock_path, messages):
+    # A daemon answering a single request with messages, or hanging up on it
+    # without a word when that's None.
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock_path)
+    server.listen()
+    def handle():
+        conn, addr = server.accept()
+        with conn:
+            while conn.recv(65536):
+                pass
+            for message in messages or ():
+                conn.sendall(json.dumps(message).encode() + b"\n")
+        server.close()
+    thread = threading.Thread(target=handle)
+    thread.start()
+    return thread
+
+def test_no_daemon(sock_path):
+    assert call_daemon(["latest"]) is False
+
+def test_stale_socket(sock_path):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock_path)
+    server.close()
+    assert call_daemon(["latest"]) is False
+
+def test_no_fallback_once_sent(sock_path):
+    # The daemon might've run the command already, don't run it again.
+    thread = serve_once(sock_path, None)
+    with pytest.raises(SystemExit) as ex:
+        call_daemon(["latest"])
+    thread.join()
+    assert "no reply from daemon" in str(ex.value.code)
+
+def test_declined(sock_path):
+    thread = serve_once(sock_path, [{"declined": "timezone"}])
+    assert call_daemon(["latest"]) is False
+    thread.join()
+
+def test_cut_short(sock_path):
+    thread = serve_once(sock_path, [{"stdout": "results\n"}])
+    with pytest.raises(SystemExit) as ex:
+        call_daemon(["latest"])
+    thread.join()
+    assert "no reply from daemon" in str(ex.value.code)
+
+def test_reply_order(sock_path, monkeypatch):
+    # Output comes out in the order the daemon's command wrote it.
+    written = []
+    for name in ("stdout", "stderr"):
+        monkeypatch.setattr(mneme_client.sys, name, SimpleNamespace(
+            write=written.append, flush=lambda: None
+        ))
+    thread = serve_once(sock_path, [
+        {"stdout": "results\n"}, {"stderr": "---\n"}, {"stdout": "more\n"},
+        {"stderr": "Next page\n"}, {"status": 0}
+    ])
+    assert call_daemon(["latest"]) is True
+    thread.join()
+    assert written == ["results\n", "---\n", "more\n", "Next page\n"]
+
+def test_status(sock_path):
+    thread = serve_once(sock_path, [{"status": 2}])
+    with pytest.raises(SystemExit) as ex:
+        call_daemon(["latest"])
+    thread.join()
+    assert ex.value.code == 2
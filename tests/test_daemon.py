@@ -0,0 +1,84 @@
+import json
+import os
+import socket
+import sys
+
+import pytest
+
+from mneme_daemon import (
+    REPLY_CHUNK_SIZE, clear_stale_socket, reply_stream, routed_stream,
+    run_captured
+)
+
+
+def routed(monkeypatch):
+    # In the test itself, pytest swaps out sys.stdout for each phase.
+    monkeypatch.setattr(sys, "stdout", routed_stream("stdout", sys.stdout))
+    monkeypatch.setattr(sys, "stderr", routed_stream("stderr", sys.stderr))
+
+def messages(chunks):
+    return [json.loads(line) for chunk in chunks
+            for line in chunk.splitlines()]
+
+def test_run_captured(monkeypatch):
+    routed(monkeypatch)
+    def command():
+        print("results")
+        print("---", file=sys.stderr)
+        print("more")
+        sys.exit("Nothing more to see.")
+    chunks = []
+    assert run_captured(command, reply_stream(chunks.append)) == 1
+    assert messages(chunks) == [
+        {"stdout": "results\n"}, {"stderr": "---\n"}, {"stdout": "more\n"},
+        {"stderr": "Nothing more to see.\n"}
+    ]
+
+def test_streams_in_chunks(monkeypatch):
+    routed(monkeypatch)
+    def command():
+        for i in range(10):
+            sys.stdout.write("x" * (REPLY_CHUNK_SIZE // 4))
+    chunks = []
+    assert run_captured(command, reply_stream(chunks.append)) == 0
+    assert len(chunks) == 3
+    assert "".join(m["stdout"] for m in messages(chunks)) \
+        == "x" * (REPLY_CHUNK_SIZE // 4 * 10)
+
+def test_client_gone(monkeypatch):
+    routed(monkeypatch)
+    def send(data):
+        raise BrokenPipeError()
+    written = []
+    def command():
+        while True:
+            sys.stdout.write("x" * 1024)
+            written.append(1)
+    assert run_captured(command, reply_stream(send)) == 1
+    assert len(written) < REPLY_CHUNK_SIZE // 1024
+
+def test_clear_stale_socket(tmp_path):
+    sock_path = str(tmp_path / "mneme.sock")
+    clear_stale_socket(sock_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(sock_path)
+    sock.close()
+    clear_stale_socket(sock_path)
+    assert not os.path.exists(sock_path)
+
+def test_keep_other_files(tmp_path):
+    not_a_socket = tmp_path / "notes.txt"
+    not_a_socket.write_text("precious")
+    with pytest.raises(SystemExit):
+        clear_stale_socket(str(not_a_socket))
+    assert not_a_socket.read_text() == "precious"
+
+def test_daemon_running(tmp_path):
+    sock_path = str(tmp_path / "mneme.sock")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(sock_path)
+    sock.listen()
+    with pytest.raises(SystemExit):
+        clear_stale_socket(sock_path)
+    sock.close()
+    assert os.path.exists(sock_path)
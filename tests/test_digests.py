@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from mneme_digests import (
+    CK_SAMPLE_SIZE, SKIP_VALUES, _sample_preadv, _sample_seek,
+    sample_locations, sample_plan
+)
+from mneme_fixtures import hash_all, legacy_sample_locations, sparse_files
+
+# Digests of `sparse_files` as computed by the original seek/read sampling,
+# an errno where hashing is refused.
+KNOWN_DIGESTS = {
+    0: "0000000000006fa1d8fcfd719046d762",
+    1: 22,
+    CK_SAMPLE_SIZE - 1: "000000004004efbc331b51f4b39f9b05",
+    CK_SAMPLE_SIZE: "000000004004efbc331b51f4b39f9b05",
+    CK_SAMPLE_SIZE + 1: "000000004004efbc331b51f4b39f9b05",
+    2 * CK_SAMPLE_SIZE: "000000008007b3cffed2ce25851f1118",
+    32 * CK_SAMPLE_SIZE + 3: "00000008000699150e8cd912cceb06d6",
+    # The midpoint or end sample overlaps a skip, which the preadv reader
+    # coalesces into a single read.
+    2 * SKIP_VALUES[0] + 100: "00000020006999c484fe4c23433f2b49",
+    SKIP_VALUES[0] + CK_SAMPLE_SIZE + 5: "000000104007781b897e09249954e6bf",
+    2 * SKIP_VALUES[0] * SKIP_VALUES[1] + CK_SAMPLE_SIZE:
+        "000001004003e093965fcc777053e376",
+    5 * 10**9 + 7: "00012a05f20dec6f159cd85b030ea4e3",
+    1 << 36: "001000000007be3d5cd05a2f139332c2",
+}
+
+
+@pytest.mark.parametrize("sampler", [_sample_seek, _sample_preadv, None])
+def test_known_digests(tmp_path, sampler):
+    sizes = list(KNOWN_DIGESTS)
+    filepaths = sparse_files(str(tmp_path), sizes)
+    assert hash_all(filepaths, sampler) == list(KNOWN_DIGESTS.values())
+
+def test_samplers_agree(tmp_path):
+    rnd = random.Random(0)
+    sizes = [rnd.randrange(1 << 20, 1 << 36) for i in range(50)]
+    filepaths = sparse_files(str(tmp_path), sizes)
+    seek = hash_all(filepaths, _sample_seek)
+    assert hash_all(filepaths, _sample_preadv) == seek
+    assert hash_all(filepaths, None) == seek
+
+def test_sample_locations_match_legacy():
+    rnd = random.Random(0)
+    sizes = list(range(-4, 4 * CK_SAMPLE_SIZE))
+    # Around each skip, where the end sample and midpoint come into play.
+    near = range(-CK_SAMPLE_SIZE, CK_SAMPLE_SIZE)
+    sizes += [SKIP_VALUES[0] * SKIP_VALUES[1]**i + d
+              for i in range(8) for d in near]
+    sizes += [rnd.randrange(1 << 48) for i in range(10000)]
+    for size in sizes:
+        expected = legacy_sample_locations(size)
+        assert list(sample_locations(size)) == expected
+        plan = sample_plan(size)
+        assert [off + rel for off, length, samples in plan
+                for rel in samples] == expected
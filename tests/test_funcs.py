@@ -0,0 +1,27 @@
+from mneme_fixtures import legacy_replace_ws, synthetic_paths
+from mneme_funcs import print_rows, replace_ws
+
+# Everything that gets escaped, next to lookalikes that don't.
+TRICKY = ["", "plain", "\t", "\n", "\r", "\\", "\\t", "\\\\t", "a\tb\nc\rd\\e",
+          "trailing\\", "\\n\n", "\x0b\x0c", "tab\t\t\tend"]
+
+
+def test_replace_ws_matches_legacy():
+    for s in TRICKY + synthetic_paths(5000):
+        assert replace_ws(s) == legacy_replace_ws(s)
+
+def test_nul_rows(capsys):
+    rows = [("/media/a\tb\nc.mkv", "2024-05-01T12:00:00.000000Z", None),
+            ("", "2024-05-02T12:00:00.000000Z", 0)]
+    print_rows(["filepath", "start_dt", "play_secs"], rows, "nul")
+    fields = capsys.readouterr().out.split("\0")
+    # The header ends with an empty field, then rows follow unescaped.
+    names = fields[:fields.index("")]
+    assert names == ["filepath", "start_dt", "play_secs"]
+    data = fields[len(names) + 1:]
+    assert data.pop() == ""
+    assert [tuple(data[i:i + len(names)])
+            for i in range(0, len(data), len(names))] == [
+        ("/media/a\tb\nc.mkv", "2024-05-01T12:00:00.000000Z", ""),
+        ("", "2024-05-02T12:00:00.000000Z", "0"),
+    ]
@@ -0,0 +1,42 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from mneme_misc import (
+    GRIPS_CHECKPOINT, calc_grips, event_grip, grip_collisions
+)
+import mneme_sql as sql
+
+
+def wrong_grips(conn):
+    return sum(row.grip != event_grip(row) for row in
+               sql.typed(conn.cursor(), sql.closed_event)
+               .execute(sql.CLOSED_EVENTS, (0, -1)))
+
+def test_calc_grips_resumes(grips_db):
+    conn = grips_db
+    # Interrupted after two chunks, then resumed from the checkpoint.
+    job = calc_grips(conn, 100)
+    done = sum(rows for last_id, rows, updates in (next(job), next(job)))
+    job.close()
+    assert conn.execute(sql.GET_META, (GRIPS_CHECKPOINT,)).fetchone()
+    done += sum(rows for last_id, rows, updates in calc_grips(conn, 100))
+    assert done == 2000
+    assert wrong_grips(conn) == 0
+    assert conn.execute(sql.GET_META, (GRIPS_CHECKPOINT,)).fetchone() is None
+
+def test_calc_grips_pool(grips_db):
+    conn = grips_db
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        for chunk in calc_grips(conn, 100, pool):
+            pass
+    assert wrong_grips(conn) == 0
+
+def test_grip_collisions(grips_db):
+    conn = grips_db
+    for chunk in calc_grips(conn, 100):
+        pass
+    first = conn.execute(sql.CLOSED_EVENTS, (0, 1)).fetchone()
+    assert grip_collisions(conn, [first[5]]) == []
+    # An open event that happens to go by the grip of a closed one.
+    conn.execute("INSERT INTO history(file_id, ftrack_id, start_dt, grip) "
+                 "VALUES(1, 1, '', ?)", (first[5],))
+    assert grip_collisions(conn, [first[5]]) == [(first[5], 2)]
@@ -0,0 +1,93 @@
+import random
+from collections import defaultdict
+
+import pytest
+
+from mneme_modify import parse_del_args, resolve_grip_specs
+from mnemedt import mnemedt
+
+INSERT_EVENT = ("INSERT INTO history(file_id, ftrack_id, start_dt, grip) "
+                "VALUES(1, 1, ?, ?)")
+
+
+@pytest.fixture
+def conn(scratch_db):
+    scratch_db.execute("INSERT INTO files(hash) VALUES('')")
+    scratch_db.execute("INSERT INTO filetrack(file_id, filepath, "
+                       "first_seen_dt, last_seen_dt) VALUES(1, '', '', '')")
+    return scratch_db
+
+def random_start(rnd):
+    # Within a few years, so some events of a grip share a month or a day.
+    start = int(mnemedt.fromstr("2022-01-01T00:00:00Z"))
+    return str(mnemedt.fromint(start + rnd.randrange(3 * 365 * 86400 * 10**6)))
+
+def stored_specs(conn):
+    return conn.execute("SELECT id, grip_spec FROM history ORDER BY id") \
+        .fetchall()
+
+def expected_specs(conn):
+    return conn.execute("SELECT id, grip_spec FROM v_grip_specs ORDER BY id") \
+        .fetchall()
+
+def test_triggers_keep_grip_specs(conn):
+    rnd = random.Random(0)
+    grips = ["{:08x}".format(i) for i in range(20)]
+    for i in range(500):
+        conn.execute(INSERT_EVENT, (random_start(rnd), rnd.choice(grips)))
+    assert stored_specs(conn) == expected_specs(conn)
+    assert conn.execute("SELECT count(id) FROM history "
+                        "WHERE grip_spec IS NULL").fetchone() == (0,)
+
+    for i in range(100):
+        conn.execute("UPDATE history SET grip = ? WHERE id = ?",
+                     (rnd.choice(grips + ["unique{:02x}".format(i)]),
+                      rnd.randrange(1, 501)))
+        conn.execute("UPDATE history SET start_dt = ? WHERE id = ?",
+                     (random_start(rnd), rnd.randrange(1, 501)))
+        conn.execute("DELETE FROM history WHERE id = ?",
+                     (rnd.randrange(1, 501),))
+    assert stored_specs(conn) == expected_specs(conn)
+
+def test_unique_grips_skip_triggers(conn):
+    # Recomputing grip-specs goes over every event sharing the grip, so doing
+    # it for events of unique grips would make loading history quadratic.
+    fired = []
+    conn.set_trace_callback(fired.append)
+    rnd = random.Random(0)
+    conn.execute(INSERT_EVENT, (random_start(rnd), "00000000"))
+    unique = len(fired)
+    conn.executemany(INSERT_EVENT, ((random_start(rnd), "{:08x}".format(i))
+                                    for i in range(1, 1000)))
+    assert len(fired) == 1000 * unique
+    del fired[:]
+    conn.execute(INSERT_EVENT, (random_start(rnd), "00000000"))
+    assert len(fired) == unique + 1
+
+def test_resolve_grip_specs(conn):
+    rnd = random.Random(0)
+    grips = ["{:08x}".format(i) for i in range(50)]
+    conn.executemany(INSERT_EVENT, ((random_start(rnd), rnd.choice(grips))
+                                    for i in range(1000)))
+    events = conn.execute(
+        "SELECT id, coalesce(grip_spec, grip), substr(start_dt, 1, 10), grip "
+        "FROM history"
+    ).fetchall()
+    # Events on the same day as one with the same grip are the only ones we
+    # can't tell apart.
+    same_day = defaultdict(list)
+    for hist_id, spec, day, grip in events:
+        same_day[(day, grip)].append(hist_id)
+
+    resolved = {spec: [match.id for match in matches] for spec, matches in
+                resolve_grip_specs(conn.cursor(), parse_del_args(
+                    [spec for hist_id, spec, day, grip in events]))}
+    for hist_id, spec, day, grip in events:
+        assert sorted(resolved[spec]) == sorted(same_day[(day, grip)])
+
+def test_resolve_repeated_grip_spec(conn):
+    conn.execute(INSERT_EVENT, ("2024-05-01T12:00:00.000000Z", "0000abcd"))
+    specs = parse_del_args(["0000abcd", "0000abcd", "2024.0000abcd"])
+    resolved = [(spec, [match.id for match in matches]) for spec, matches in
+                resolve_grip_specs(conn.cursor(), specs)]
+    assert sorted(resolved) == [("0000abcd", [1]), ("2024.0000abcd", [1])]
@@ -0,0 +1,76 @@
+import json
+import sqlite3
+
+from mneme_common import MIGRATIONS, migrate, schema_version
+
+# Files as the original schema kept them, names in a JSON array and renames
+# counted alongside.
+FILES = (
+    ("{:032x}".format(1), ["a.mkv"]),
+    ("{:032x}".format(2), ["b.mkv", "b (1).mkv", "B.mkv"]),
+    ("{:032x}".format(3), ["c.mkv", "c, again.mkv"]),
+    # No filetrack for this one, it still gets its names.
+    ("{:032x}".format(4), ["d.mkv", "d.mp4"]),
+)
+
+
+def baseline_db(db_file):
+    # A DB as created before schema versioning, holding FILES.
+    conn = sqlite3.connect(db_file)
+    conn.executescript(MIGRATIONS[0])
+    conn.executemany(
+        "INSERT INTO files(hash, filenames, renames) VALUES(?, ?, ?)",
+        ((file_hash, json.dumps(names), len(names) - 1)
+         for file_hash, names in FILES)
+    )
+    conn.executemany(
+        "INSERT INTO filetrack(file_id, filepath, first_seen_dt, "
+        "last_seen_dt) VALUES(?, ?, ?, ?)",
+        ((1, "/media/a.mkv", "2021-01-01T00:00:00.000000Z",
+          "2021-01-01T00:00:00.000000Z"),
+         (2, "/media/b.mkv", "2021-02-01T00:00:00.000000Z",
+          "2021-03-01T00:00:00.000000Z"),
+         (2, "/other/B.mkv", "2021-01-15T00:00:00.000000Z",
+          "2021-01-15T00:00:00.000000Z"),
+         (3, "/media/c.mkv", "2021-04-01T00:00:00.000000Z",
+          "2021-04-01T00:00:00.000000Z"))
+    )
+    conn.commit()
+    return conn
+
+def test_filenames_move_out_of_json(tmp_path):
+    conn = baseline_db(str(tmp_path / "mneme.sqlite"))
+    assert schema_version(conn) == 0
+    migrate(conn)
+    assert schema_version(conn) == len(MIGRATIONS)
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(files)")]
+    assert "filenames" not in columns
+    # Names keep the order they had in the array, first seen with the file.
+    rows = conn.execute(
+        "SELECT file_id, name, first_seen_dt FROM filenames ORDER BY id"
+    ).fetchall()
+    assert [(file_id, name) for file_id, name, seen in rows] == [
+        (i, name) for i, (file_hash, names) in enumerate(FILES, 1)
+        for name in names
+    ]
+    seen = {file_id: seen for file_id, name, seen in rows}
+    assert seen[1] == "2021-01-01T00:00:00.000000Z"
+    assert seen[2] == "2021-01-15T00:00:00.000000Z"
+    assert seen[3] == "2021-04-01T00:00:00.000000Z"
+    assert seen[4]
+    assert conn.execute("SELECT id, renames FROM files ORDER BY id") \
+        .fetchall() == [(i, len(names) - 1)
+                        for i, (file_hash, names) in enumerate(FILES, 1)]
+    assert conn.execute(
+        "SELECT file_id FROM filenames_fts JOIN filenames "
+        "ON filenames.id = filenames_fts.rowid "
+        "WHERE filenames_fts MATCH '\"again\"'"
+    ).fetchall() == [(3,)]
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+
+    # A new name goes through the trigger, counting as a rename.
+    conn.execute("INSERT INTO filenames(file_id, name, first_seen_dt) "
+                 "VALUES(1, 'a (1).mkv', '2022-01-01T00:00:00.000000Z')")
+    assert conn.execute("SELECT renames FROM files WHERE id = 1") \
+        .fetchone() == (1,)
@@ -0,0 +1,72 @@
+import pytest
+
+import mneme_sql as sql
+
+
+def keysets(op):
+    return ([], ["start_dt {} ?".format(op)],
+            ["(start_dt, h.id) {} (?, ?)".format(op)])
+
+def all_statements():
+    # Every statement we prepare, including the variants built at runtime.
+    stmts = {value for name, value in vars(sql).items()
+             if name.isupper() and isinstance(value, str)}
+    stmts |= {sql.events_sql(conds, True) for conds in keysets("<")}
+    stmts |= {sql.events_sql(conds + [cond])
+              for conds in keysets(">")
+              for cond in (sql.EVENTS_FTS_COND, sql.EVENTS_LIKE_COND)}
+    stmts |= {sql.file_names_sql(), sql.file_names_sql(sql.PURGE_HASHES_COND)}
+    for table, select in sql.UNREFERENCED:
+        stmts |= {sql.COUNT_UNREFERENCED.format(select),
+                  sql.DELETE_UNREFERENCED.format(table, select)}
+    stmts |= {sql.plays_sql(period) for period in sql.PLAY_PERIODS}
+    return stmts
+
+# Statements with (parameters for them and) the indices their query plans
+# should be using.
+PLAN_CHECKS = (
+    ("now playing", sql.NOW_PLAYING, (), ("history_idx2",)),
+    ("latest", sql.events_sql([], True), (1, 0),
+     ("history_idx2", "gc USING PRIMARY KEY")),
+    ("latest before", sql.events_sql(keysets("<")[2], True), ("", 0, 1, 0),
+     ("history_idx2 (start_dt<?)",)),
+    ("search", sql.events_sql([sql.EVENTS_FTS_COND]), ("", 1, 0),
+     ("filetrack_fts", "history_idx1 (ftrack_id=?)")),
+    ("file search", sql.FILES_MATCHING, ("",),
+     ("filetrack_fts", "filenames_fts", "filetrack_uniq (file_id=?)")),
+    ("hashes", sql.file_names_sql(), (), ("filenames_uniq (file_id=?)",)),
+    ("purged hashes", sql.file_names_sql(sql.PURGE_HASHES_COND), (),
+     ("sqlite_autoindex_files_1 (hash=?)",)),
+    ("known signatures", sql.KNOWN_SIGNATURES, ("[]",),
+     ("filetrack_idx1 (filepath=?)",)),
+    ("ingest file IDs", sql.SET_INGEST_FILE_IDS, (),
+     ("sqlite_autoindex_files_1 (hash=?)",)),
+    ("ingest filetrack IDs", sql.SET_INGEST_FTRACK_IDS, (),
+     ("filetrack_uniq (file_id=? AND filepath=?)",)),
+    ("record stops", sql.UPDATE_STOPS, ("", 0, "[]"),
+     ("history USING INTEGER PRIMARY KEY",)),
+    ("resolve grip-specs", sql.RESOLVE_GRIP_SPECS, (),
+     ("history_idx5 (grip=? AND start_dt>? AND start_dt<?)",)),
+    ("unreferenced filepaths",
+     sql.COUNT_UNREFERENCED.format(sql.UNREFERENCED[0][1]), (),
+     ("history_idx1 (ftrack_id=?)",)),
+    ("unreferenced files",
+     sql.COUNT_UNREFERENCED.format(sql.UNREFERENCED[1][1]), (),
+     ("history_idx4 (file_id=?)",)),
+    ("plays per day", sql.plays_sql("days"), ("-9 days",),
+     ("play_days USING PRIMARY KEY (day>?)",)),
+    ("top files", sql.TOP_FILES, (10,), ("file_plays_idx",)),
+    ("renamed files", sql.RENAMED_FILES, (10,), ("files_idx_renames",)),
+)
+
+
+def test_statements_fit_cache():
+    assert len(all_statements()) <= sql.STATEMENT_CACHE_SIZE
+
+@pytest.mark.parametrize("name,stmt,params,indices", PLAN_CHECKS,
+                         ids=[check[0] for check in PLAN_CHECKS])
+def test_query_plan(scratch_db, name, stmt, params, indices):
+    plan = "\n".join(row[3] for row in
+                     scratch_db.execute("EXPLAIN QUERY PLAN " + stmt, params))
+    for index in indices:
+        assert index in plan
@@ -0,0 +1,18 @@
+import pytest
+
+from mneme_query import get_keyset
+
+
+def test_keyset():
+    assert get_keyset({}, "--before", "<") == ([], [])
+    assert get_keyset({"--before": "2024-05-01T12:00:00Z"}, "--before", "<") \
+        == (["start_dt < ?"], ["2024-05-01T12:00:00.000000Z"])
+    assert get_keyset({"--after": "2024-05-01T12:00:00Z,7"}, "--after", ">") \
+        == (["(start_dt, h.id) > (?, ?)"], ["2024-05-01T12:00:00.000000Z", 7])
+
+@pytest.mark.parametrize("value", ["garbage", "2024-13-01",
+                                   "2024-05-01T12:00:00Z,x"])
+def test_bad_keyset(value):
+    with pytest.raises(SystemExit) as ex:
+        get_keyset({"--before": value}, "--before", "<")
+    assert value in ex.value.code
@@ -0,0 +1,56 @@
+import random
+import sqlite3
+
+from mneme_common import convert_timestamps, timestamp_mode, to_db
+from mnemedt import mnemedt
+
+# Everything convert_timestamps rebuilds, in a stable order.
+DUMP = ("SELECT * FROM history ORDER BY id",
+        "SELECT * FROM filetrack ORDER BY id",
+        "SELECT * FROM filenames ORDER BY file_id, name",
+        "SELECT * FROM grip_counts ORDER BY grip",
+        "SELECT * FROM play_days ORDER BY day",
+        "SELECT * FROM v_grip_specs ORDER BY id")
+
+
+def dump(conn):
+    return [conn.execute(stmt).fetchall() for stmt in DUMP]
+
+def month_plays(conn):
+    month = [mnemedt.fromstr(dt) for dt in ("2025-03-01T00:00:00Z",
+                                           "2025-04-01T00:00:00Z")]
+    return conn.execute(
+        "SELECT id FROM history WHERE start_dt >= ? AND start_dt < ? "
+        "ORDER BY id", [to_db(dt) for dt in month]
+    ).fetchall()
+
+def test_int_codec_round_trips():
+    rnd = random.Random(0)
+    start = int(mnemedt.fromstr("2016-01-01T00:00:00Z"))
+    ints = sorted(rnd.randrange(start, start + 10 * 365 * 86400 * 10**6)
+                  for i in range(10000))
+    texts = [str(mnemedt.fromint(i)) for i in ints]
+    assert [int(mnemedt.fromstr(t)) for t in texts] == ints
+    assert [int(mnemedt.fromdb(i)) for i in ints] == ints
+    assert [str(mnemedt.fromdb(t)) for t in texts] == texts
+    # Both sort the same, so ranges over either select the same events.
+    assert sorted(texts) == texts
+
+def test_convert_timestamps_round_trips(synthetic_db):
+    conn = sqlite3.connect(synthetic_db)
+    before = dump(conn)
+    plays = month_plays(conn)
+    assert plays
+
+    assert convert_timestamps(conn, "int")
+    assert timestamp_mode(conn) == "int"
+    assert conn.execute("SELECT count(id) FROM history "
+                        "WHERE typeof(start_dt) <> 'integer'").fetchone() \
+        == (0,)
+    assert month_plays(conn) == plays
+    assert not convert_timestamps(conn, "int")
+
+    assert convert_timestamps(conn, "text")
+    assert timestamp_mode(conn) == "text"
+    assert dump(conn) == before
+    assert conn.execute("PRAGMA integrity_check").fetchone() == ("ok",)
@@ -0,0 +1,64 @@
+import sqlite3
+
+from mneme_common import MIGRATIONS, migrate, write_transaction
+from mneme_fixtures import legacy_record_launch, legacy_record_stops
+from mneme_wrapper import (
+    ingest_and_start, record_stops, register_grip_functions
+)
+from mnemedt import mnemedt
+
+# Launches of (filepath, hash): the same path twice, a renamed copy, the same
+# content in another directory, then a rename and a new file.
+LAUNCHES = (
+    [("/media/a.mkv", "a"), ("/media/a.mkv", "a"),
+     ("/media/copy of a.mkv", "a"), ("/media/b.mkv", "b"),
+     ("/backup/b.mkv", "b")],
+    [("/media/b, renamed.mkv", "b"), ("/media/c.mkv", "c"),
+     ("/media/a.mkv", "a")],
+)
+START = int(mnemedt.fromstr("2024-05-01T20:00:00Z"))
+PLAY_SECS = 1800 * 10**6
+
+# What a launch leaves behind, minus when names were first seen: the original
+# schema didn't keep that, migrating takes it from the file's filepaths.
+DUMP = ("SELECT * FROM files ORDER BY id",
+        "SELECT id, file_id, name FROM filenames ORDER BY file_id, id",
+        "SELECT * FROM filetrack ORDER BY id",
+        "SELECT id, file_id, ftrack_id, start_dt, stop_dt, play_secs, grip "
+        "FROM history ORDER BY id")
+
+
+def dump(conn):
+    return [conn.execute(stmt).fetchall() for stmt in DUMP]
+
+def launch_times(i):
+    before = mnemedt.fromint(START + i * 86400 * 10**6)
+    after = mnemedt.fromint(int(before) + PLAY_SECS)
+    return before, after
+
+def test_ingest_matches_legacy(tmp_path):
+    legacy = sqlite3.connect(str(tmp_path / "legacy.sqlite"))
+    legacy.executescript(MIGRATIONS[0])
+    for i, hashed in enumerate(LAUNCHES):
+        before, after = launch_times(i)
+        cur = legacy.cursor()
+        hist_ids = legacy_record_launch(cur, hashed, before)
+        legacy_record_stops(cur, hist_ids, after, after - before)
+        legacy.commit()
+    migrate(legacy)
+
+    conn = sqlite3.connect(str(tmp_path / "mneme.sqlite"))
+    migrate(conn)
+    register_grip_functions(conn)
+    for i, hashed in enumerate(LAUNCHES):
+        before, after = launch_times(i)
+        hist_ids = write_transaction(conn, ingest_and_start, hashed, before)
+        assert len(hist_ids) == len(hashed)
+        write_transaction(conn, record_stops, hist_ids, after, after - before)
+
+    assert dump(conn) == dump(legacy)
+    # Each name is first seen in the launch it came with.
+    assert conn.execute(
+        "SELECT name, first_seen_dt FROM filenames WHERE name = ?",
+        ("b, renamed.mkv",)
+    ).fetchone() == ("b, renamed.mkv", str(launch_times(1)[0]))